@@ -1,13 +1,25 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q
 from django_filters import rest_framework as filters
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Ingredient, Recipe, RecipeIngredients
+from recipes.tag_index import tag_index
 
 User = get_user_model()
 
 
+def get_tag_choices():
+    """Доп.функция: слаги тегов из словаря `tag_index`."""
+    return tag_index.choices()
+
+
 class IngredientFilter(filters.FilterSet):
     """Фильтр для поиска по списку ингредиентов
-    (поиск ведется по вхождению в начало названия)."""
+    (поиск ведется по вхождению в начало названия).
+    Список ингредиентов отдается из индекса `ingredient_index`,
+    фильтр описывает параметр `name` для схемы API."""
     name = filters.CharFilter(
         field_name='name',
         lookup_expr='istartswith'
@@ -19,11 +31,12 @@ class IngredientFilter(filters.FilterSet):
 
 
 class RecipeFilter(filters.FilterSet):
-    """Фильтр для рецептов."""
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    """Фильтр для рецептов.
+    Слаги тегов проверяются и переводятся в id по словарю `tag_index`
+    без запросов к таблице тегов."""
+    tags = filters.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method='filter_tags'
     )
 
     is_favorited = filters.BooleanFilter(
@@ -32,11 +45,24 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_shopping_cart'
     )
+    search = filters.CharFilter(
+        method='filter_search'
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='filter_ordering'
+    )
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author',)
 
+    def filter_tags(self, queryset, name, value):
+        """Рецепты с любым из тегов: подзапрос к связующей таблице
+        вместо соединения, поэтому строки рецептов не повторяются."""
+        return queryset.filter(id__in=Recipe.tags.through.objects.filter(
+            tag_id__in=tag_index.ids(value)).values('recipe_id'))
+
     def filter_favorited(self, queryset, name, value):
         """Фильтруем рецепты по избранным."""
         user = self.request.user
@@ -50,3 +76,25 @@ class RecipeFilter(filters.FilterSet):
         if value and not user.is_anonymous:
             return queryset.filter(shopping_cart__user=user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, описанию и ингредиентам
+        (в PostgreSQL - с ранжированием, иначе - поиск по вхождению)."""
+        if connection.vendor == 'postgresql':
+            query = SearchQuery(
+                value, config=settings.SEARCH_CONFIG, search_type='websearch')
+            return queryset.filter(search_vector=query).annotate(
+                rank=SearchRank(F('search_vector'), query)).order_by(
+                    '-rank', *Recipe._meta.ordering)
+        return queryset.filter(
+            Q(name__icontains=value)
+            | Q(text__icontains=value)
+            | Q(id__in=RecipeIngredients.objects.filter(
+                ingredient__name__icontains=value).values('recipe'))
+        )
+
+    def filter_ordering(self, queryset, name, value):
+        """Сортируем рецепты по числу добавлений в избранное."""
+        if value == 'popular':
+            return queryset.order_by('-favorites_count', '-pub_date')
+        return queryset
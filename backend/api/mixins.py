@@ -0,0 +1,165 @@
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from users.models import User
+
+from .serializers import BatchSerializer
+
+
+class ConditionalGetMixin:
+    """Поддержка условных GET-запросов (ETag / Last-Modified).
+    Если данные не изменились, отвечаем 304 без запуска сериализатора.
+    Условия для запроса возвращает `get_conditions`."""
+    conditional_actions = ('list', 'retrieve')
+
+    def get_conditions(self, request):
+        """Возвращаем (части слабого ETag, время изменения в секундах)
+        или (None, None), если условный ответ невозможен."""
+        return None, None
+
+    def make_etag(self, *parts):
+        digest = md5(
+            '-'.join(str(part) for part in parts).encode()).hexdigest()
+        return quote_etag(f'W/"{digest}"')
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.conditional_actions:
+            return handler(request, *args, **kwargs)
+        etag_parts, last_modified = self.get_conditions(request)
+        etag = self.make_etag(*etag_parts) if etag_parts else None
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            if etag:
+                response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs)
+
+
+class AnonymousListCacheMixin:
+    """Кэш готового JSON страниц списка для анонимных пользователей.
+    Ключ строится из версий данных (`get_list_cache_versions`) и
+    нормализованных параметров `list_cache_params`: после изменения
+    данных старые ключи просто перестают запрашиваться."""
+    list_cache_params = ()
+    list_cache_timeout = None
+
+    def get_list_cache_versions(self):
+        return ()
+
+    def get_list_cache_key(self, request):
+        key_parts = [request.get_host(), *self.get_list_cache_versions()]
+        for name in self.list_cache_params:
+            if name in request.query_params:
+                values = sorted(request.query_params.getlist(name))
+                key_parts.append(f'{name}={",".join(values)}')
+        digest = md5('|'.join(map(str, key_parts)).encode()).hexdigest()
+        return f'list:{self.basename}:{digest}'
+
+    def list(self, request, *args, **kwargs):
+        if (not request.user.is_anonymous
+                or request.accepted_renderer.format != 'json'):
+            return super().list(request, *args, **kwargs)
+        key = self.get_list_cache_key(request)
+        content = cache.get(key)
+        if content is not None:
+            response = HttpResponse(
+                content, content_type=request.accepted_media_type)
+        else:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code == 200:
+                response.add_post_render_callback(
+                    lambda rendered: cache.set(
+                        key, rendered.content, self.list_cache_timeout))
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+
+class BatchRelationMixin:
+    """Пакетное добавление и удаление связей пользователя с объектами
+    (избранное, корзина, подписки): одна вставка и одно удаление на
+    пакет, в ответе - результат по каждому id.
+    Строки пользователя блокируются на время пакета, поэтому
+    результаты и счетчики точны при параллельных запросах."""
+    batch_model = None
+    batch_target_model = None
+    batch_field = None
+
+    def get_batch_invalid_ids(self, request):
+        """Id объектов, связь с которыми недопустима."""
+        return set()
+
+    def batch_applied(self, request, added, removed):
+        """Доп.функция: действия после добавления и удаления связей
+        (счетчики, списки покупок)."""
+
+    def get_batch_status(self, pk, adding, found, present, invalid):
+        """Доп.функция: результат операции с одним id."""
+        if pk not in found:
+            return 'not_found'
+        if adding and pk in invalid:
+            return 'invalid'
+        if adding:
+            return 'exists' if pk in present else 'created'
+        return 'deleted' if pk in present else 'missing'
+
+    def apply_batch(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add = serializer.validated_data['add']
+        remove = serializer.validated_data['remove']
+        field = self.batch_field
+        invalid = self.get_batch_invalid_ids(request)
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(
+                pk=request.user.pk).values_list('pk', flat=True))
+            found = set(self.batch_target_model.objects.filter(
+                pk__in=[*add, *remove]).values_list('pk', flat=True))
+            relations = self.batch_model.objects.filter(user=request.user)
+            present = set(relations.filter(
+                **{f'{field}__in': found}).values_list(
+                    f'{field}_id', flat=True))
+            added = [
+                pk for pk in add
+                if pk in found and pk not in present and pk not in invalid
+            ]
+            removed = [pk for pk in remove if pk in present]
+            self.batch_model.objects.bulk_create(
+                [
+                    self.batch_model(user=request.user, **{f'{field}_id': pk})
+                    for pk in added
+                ],
+                ignore_conflicts=True
+            )
+            if removed:
+                relations.filter(**{f'{field}__in': removed}).delete()
+            self.batch_applied(request, added, removed)
+        results = [
+            {
+                'id': pk,
+                'action': action,
+                'status': self.get_batch_status(
+                    pk, action == 'add', found, present, invalid),
+            }
+            for action, ids in (('add', add), ('remove', remove))
+            for pk in ids
+        ]
+        return Response({'results': results}, status=status.HTTP_200_OK)
@@ -1,6 +1,205 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from collections import OrderedDict
+
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class CustomCursorPagination(BasePagination):
+    """Курсорная (keyset) паджинация с учетом параметра `limit`.
+    Курсор хранит значения полей `ordering` последнего объекта страницы,
+    следующая страница выбирается условием по ним, без OFFSET.
+    Поле `count` - оценка планировщика PostgreSQL."""
+    ordering = ('id',)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def get_ordering(self, request):
+        """Ключ сортировки для запроса."""
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        self.queryset = queryset
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def get_fields(self, ordering=None):
+        return [
+            (name.lstrip('-'), name.startswith('-'))
+            for name in ordering or self.ordering
+        ]
+
+    def get_position_filter(self, position, ordering=None):
+        """Условие "строго после позиции" для составного ключа:
+        (a < x) OR (a = x AND b < y) OR ..."""
+        condition = Q()
+        equal = {}
+        fields = self.get_fields(ordering)
+        for (name, descending), value in zip(fields, position):
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, obj):
+        model = self.queryset.model
+        position = [
+            model._meta.get_field(name).value_to_string(obj)
+            for name, _ in self.get_fields()
+        ]
+        cursor = b64encode(json.dumps(position).encode()).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        model = self.queryset.model
+        try:
+            position = json.loads(b64decode(cursor.encode()).decode())
+            fields = self.get_fields()
+            if len(position) != len(fields):
+                raise ValueError
+            return [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(fields, position)
+            ]
+        except (BinasciiError, UnicodeDecodeError, ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_count(self):
+        """Оценка количества объектов по плану запроса (PostgreSQL),
+        на остальных СУБД - точный COUNT."""
+        if connection.vendor != 'postgresql':
+            return self.queryset.count()
+        sql, params = self.queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.get_count()),
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        ]))
+
+
+class RecipeCursorPagination(CustomCursorPagination):
+    """Курсорная паджинация ленты рецептов по ключу (pub_date, id),
+    для `ordering=popular` - по ключу (favorites_count, pub_date, id).
+    Результаты поиска упорядочены по релевантности, которую нельзя
+    использовать как ключ, поэтому курсор с `search` не принимается."""
+    ordering = ('-pub_date', '-id')
+    popular_ordering = ('-favorites_count', '-pub_date', '-id')
+    search_query_param = 'search'
+    search_cursor_message = 'Курсорная паджинация недоступна для поиска.'
+
+    def get_ordering(self, request):
+        if request.query_params.get(self.search_query_param):
+            raise ValidationError(
+                {self.cursor_query_param: self.search_cursor_message})
+        if request.query_params.get('ordering') == 'popular':
+            return self.popular_ordering
+        return self.ordering
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    """Курсорная паджинация ленты подписок по ключу (pub_date, id).
+    Страница собирается из нескольких источников рецептов: каждый
+    читается по своему индексу со своим порядком, результаты
+    сливаются и отсекаются по размеру страницы."""
+
+    def paginate_sources(self, sources, request, view=None):
+        """`sources` - тройки (queryset рецептов, условие отбора,
+        порядок сортировки, равносильный ключу (-pub_date, -id)).
+        Условие и позиция курсора применяются одним filter(), чтобы
+        для связей "один ко многим" использовалось одно соединение."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.queryset = sources[0][0]
+        position = self.decode_cursor(request)
+        self.sources = []
+        recipes = {}
+        for queryset, condition, ordering in sources:
+            self.sources.append(queryset.filter(condition))
+            if position is not None:
+                condition &= self.get_position_filter(position, ordering)
+            queryset = queryset.filter(condition).order_by(*ordering)
+            for recipe in queryset[:self.page_size + 1]:
+                recipes.setdefault(recipe.pk, recipe)
+        results = sorted(
+            recipes.values(),
+            key=lambda recipe: (recipe.pub_date, recipe.pk),
+            reverse=True
+        )[:self.page_size + 1]
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        return self.page
+
+    def get_count(self):
+        """Сумма оценок количества по всем источникам."""
+        total = 0
+        for queryset in self.sources:
+            self.queryset = queryset
+            total += super().get_count()
+        return total
 
 
 class CustomPageNumberPagination(PageNumberPagination):
-    """Кастомный паджинатор с учетом параметра `limit`."""
+    """Кастомный паджинатор с учетом параметра `limit`.
+    Если во view задан `cursor_pagination_class` и в запросе есть
+    параметр `cursor`, страницы отдаются курсорной паджинацией."""
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_pagination_class = getattr(
+            view, 'cursor_pagination_class', None)
+        if (cursor_pagination_class
+                and self.cursor_query_param in request.query_params):
+            self.cursor_paginator = cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,24 +1,114 @@
 import base64
+from binascii import Error as BinasciiError
+from uuid import uuid4
 
+from django.conf import settings
 from django.contrib.auth.hashers import check_password
-from django.core.files.base import ContentFile
+from django.core.cache import cache
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+from django.db.models import F, Prefetch
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredients,
-                            ShoppingCart, Tag)
+from recipes.cache import (INGREDIENTS_VERSION, RECIPES_VERSION, TAGS_VERSION,
+                           bump_version, get_versions)
+from recipes.images import schedule_variants
+from recipes.models import (Favorite, FeedItem, Ingredient, Recipe,
+                            RecipeIngredients, ShoppingCart,
+                            ShoppingListIngredient, Tag)
 from rest_framework import serializers
 from users.models import Subscription, User
 
+BASE64_MARKER = ';base64,'
+MAX_DATA_URL_HEADER = 100
+BASE64_CHUNK_SIZE = 64 * 1024
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'RIFF', 'webp'),
+)
+IMAGE_INVALID = 'Загрузите корректное изображение (png, jpg, gif, webp).'
+IMAGE_TOO_LARGE = 'Размер изображения превышает допустимый.'
+
 
 class Base64ImageField(serializers.ImageField):
-    """Декодируем фото."""
+    """Декодируем фото из data URL по частям во временный файл.
+    Размер (не больше `RECIPE_IMAGE_MAX_SIZE`) проверяем до декодирования,
+    формат - по первым байтам."""
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            name = {self.context["request"].user.username}
-            data = ContentFile(base64.b64decode(imgstr), name=f'{name}.' + ext)
+            data = self.decode_to_file(data)
+        elif getattr(data, 'size', 0) > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise serializers.ValidationError(IMAGE_TOO_LARGE)
         return super().to_internal_value(data)
 
+    def decode_to_file(self, data):
+        """Доп.функция: пишем декодированное фото во временный файл."""
+        start = data.find(BASE64_MARKER, 0, MAX_DATA_URL_HEADER) + len(
+            BASE64_MARKER)
+        if start < len(BASE64_MARKER):
+            raise serializers.ValidationError(IMAGE_INVALID)
+        if (len(data) - start) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise serializers.ValidationError(IMAGE_TOO_LARGE)
+        file = None
+        try:
+            for position in range(start, len(data), BASE64_CHUNK_SIZE):
+                chunk = base64.b64decode(
+                    data[position:position + BASE64_CHUNK_SIZE],
+                    validate=True)
+                if file is None:
+                    file = TemporaryUploadedFile(
+                        f'{uuid4().hex}.{self.get_extension(chunk)}',
+                        None, 0, None)
+                file.write(chunk)
+        except (BinasciiError, serializers.ValidationError):
+            if file is not None:
+                file.close()
+            raise serializers.ValidationError(IMAGE_INVALID)
+        if file is None:
+            raise serializers.ValidationError(IMAGE_INVALID)
+        file.size = file.tell()
+        file.seek(0)
+        return file
+
+    def get_extension(self, head):
+        """Доп.функция: определяем формат фото по сигнатуре файла."""
+        for signature, extension in IMAGE_SIGNATURES:
+            if head.startswith(signature):
+                if extension == 'webp' and head[8:12] != b'WEBP':
+                    break
+                return extension
+        raise serializers.ValidationError(IMAGE_INVALID)
+
+
+class RecipeImageField(Base64ImageField):
+    """Фото рецепта: отдаем ссылку на уменьшенную копию в WebP
+    (в списках - `RECIPE_IMAGE_LIST_VARIANT`, в рецепте -
+    `RECIPE_IMAGE_DETAIL_VARIANT`), пока копии нет - на оригинал."""
+    def __init__(self, *args, variant=None, **kwargs):
+        self.variant = variant
+        super().__init__(*args, **kwargs)
+
+    def get_variant(self):
+        if self.variant:
+            return self.variant
+        if isinstance(self.parent.parent, serializers.ListSerializer):
+            return settings.RECIPE_IMAGE_LIST_VARIANT
+        return settings.RECIPE_IMAGE_DETAIL_VARIANT
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        name = value.instance.image_variants.get(self.get_variant())
+        if not name:
+            return super().to_representation(value)
+        url = value.storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
 
 class CustomUserCreateSerializer(UserCreateSerializer):
     """Кастомный сериализатор регистрации новых пользователей."""
@@ -53,7 +143,10 @@ class CustomUserSerializer(UserSerializer):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return obj.following.filter(user=request.user).exists()
+        subscribed = getattr(obj, 'subscribed', None)
+        if subscribed is None:
+            return obj.following.filter(user=request.user).exists()
+        return subscribed
 
 
 class ChangePasswordSerializer(serializers.Serializer):
@@ -87,11 +180,24 @@ class SubscriptionSerializer(CustomUserSerializer):
         }
         depth = 1
 
+    @staticmethod
+    def get_recipes_limit(request):
+        """Параметр `recipes_limit`: положительное число или None.
+        Некорректные значения игнорируем, как размер страницы."""
+        try:
+            recipes_limit = int(request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return recipes_limit if recipes_limit > 0 else None
+
     def get_recipes(self, obj):
         """Определяем список рецептов в подписке."""
-        recipes_limit = self.context['request'].GET.get('recipes_limit')
-        if recipes_limit:
-            recipes = obj.recipes.all()[:int(recipes_limit)]
+        author_recipes = self.context.get('author_recipes')
+        recipes_limit = self.get_recipes_limit(self.context['request'])
+        if author_recipes is not None:
+            recipes = author_recipes.get(obj.id, [])
+        elif recipes_limit:
+            recipes = obj.recipes.all()[:recipes_limit]
         else:
             recipes = obj.recipes.all()
         return RecipeListSerializer(
@@ -102,23 +208,10 @@ class SubscriptionSerializer(CustomUserSerializer):
 
     def get_recipes_count(self, obj):
         """Определяем общее количество рецептов в подписке."""
-        return obj.recipes.count()
-
-    def validate(self, data):
-        request = self.context.get('request')
-        author = self.instance
-        subscription = Subscription.objects.filter(
-            user=request.user, author=author).exists()
-        if request.method == 'DELETE' and not subscription:
-            raise serializers.ValidationError(
-                'Подписка уже удалена.')
-        if subscription:
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого автора.')
-        if author == request.user:
-            raise serializers.ValidationError(
-                'Вы не можете подписаться на самого себя.')
-        return data
+        recipes_count = getattr(obj, 'recipes_count', None)
+        if recipes_count is None:
+            return obj.recipes.count()
+        return recipes_count
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -161,12 +254,103 @@ class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
 class RecipeListSerializer(serializers.ModelSerializer):
     """Сериализатор рецепта для связки: рецепт<->пользователь
     (подписка, избранное)."""
+    image = RecipeImageField(
+        variant=settings.RECIPE_IMAGE_LIST_VARIANT, read_only=True)
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
         read_only_fields = ('__all__',)
 
 
+class SimilarRecipeSerializer(RecipeListSerializer):
+    """Сериализатор похожего рецепта со значением сходства."""
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + ('similarity',)
+
+
+class PantryRecipeSerializer(RecipeListSerializer):
+    """Сериализатор рецепта, подобранного по имеющимся продуктам:
+    доля имеющихся ингредиентов и число недостающих."""
+    coverage = serializers.FloatField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + ('coverage', 'missing')
+
+
+class CachedRecipeListSerializer(serializers.ListSerializer):
+    """Сериализатор списка рецептов в два этапа: общая для всех
+    пользователей часть рецепта берется из кэша (по версии рецепта),
+    а признаки избранного, корзины и подписки проставляются по трем
+    множествам id на всю страницу.
+    Ключ общей части включает даты изменения рецепта и профиля автора,
+    поэтому queryset готовится через `setup_queryset`."""
+
+    @staticmethod
+    def setup_queryset(queryset):
+        return queryset.only(
+            'id', 'author_id', 'pub_date', 'modified_at').annotate(
+                author_modified_at=F('author__modified_at'))
+
+    def get_cache_key(self, recipe, host, versions):
+        return 'recipe:{0}:{1}:{2}:{3}:{4}'.format(
+            recipe.pk, recipe.modified_at.timestamp(),
+            recipe.author_modified_at.timestamp(), host, versions)
+
+    def get_shared_representations(self, recipes):
+        request = self.context['request']
+        versions = '{0}:{1}'.format(
+            *get_versions(TAGS_VERSION, INGREDIENTS_VERSION))
+        keys = {
+            recipe.pk: self.get_cache_key(
+                recipe, request.get_host(), versions)
+            for recipe in recipes
+        }
+        cached = cache.get_many(keys.values())
+        missing = [pk for pk, key in keys.items() if key not in cached]
+        if missing:
+            fresh = {}
+            for recipe in RecipeSerializer.setup_queryset(
+                    Recipe.objects.filter(pk__in=missing)):
+                recipe.favorited = False
+                recipe.in_shopping_cart = False
+                recipe.author_subscribed = False
+                fresh[keys[recipe.pk]] = self.child.to_representation(recipe)
+            cache.set_many(fresh, settings.RECIPE_FRAGMENT_CACHE_TIMEOUT)
+            cached.update(fresh)
+        return {pk: cached[key] for pk, key in keys.items()}
+
+    def to_representation(self, data):
+        recipes = list(data)
+        shared = self.get_shared_representations(recipes)
+        user = self.context['request'].user
+        favorites = cart = subscriptions = set()
+        if not user.is_anonymous:
+            recipe_ids = [recipe.pk for recipe in recipes]
+            favorites = set(Favorite.objects.filter(
+                user=user, recipe__in=recipe_ids).values_list(
+                    'recipe_id', flat=True))
+            cart = set(ShoppingCart.objects.filter(
+                user=user, recipe__in=recipe_ids).values_list(
+                    'recipe_id', flat=True))
+            subscriptions = set(Subscription.objects.filter(
+                user=user,
+                author__in={recipe.author_id for recipe in recipes}
+            ).values_list('author_id', flat=True))
+        result = []
+        for recipe in recipes:
+            representation = shared[recipe.pk]
+            representation['is_favorited'] = recipe.pk in favorites
+            representation['is_in_shopping_cart'] = recipe.pk in cart
+            representation['author']['is_subscribed'] = (
+                recipe.author_id in subscriptions)
+            result.append(representation)
+        return result
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор рецепта."""
 
@@ -179,7 +363,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField(use_url=True)
+    image = RecipeImageField(use_url=True)
 
     class Meta:
         model = Recipe
@@ -187,20 +371,48 @@ class RecipeSerializer(serializers.ModelSerializer):
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
             'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
         )
+        list_serializer_class = CachedRecipeListSerializer
+
+    @staticmethod
+    def setup_queryset(queryset):
+        """Подгружаем автора, теги и ингредиенты для сериализации
+        фиксированным числом запросов."""
+        return queryset.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredients.objects.select_related(
+                    'ingredient')
+            ),
+        )
+
+    def to_representation(self, instance):
+        """Передаем автору аннотированный признак подписки,
+        чтобы не делать отдельный запрос на каждый рецепт."""
+        author_subscribed = getattr(instance, 'author_subscribed', None)
+        if author_subscribed is not None:
+            instance.author.subscribed = author_subscribed
+        return super().to_representation(instance)
 
     def get_is_favorited(self, obj):
         """Определяем, является ли рецепт избранным для пользователя."""
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return obj.is_favorited(request.user)
+        favorited = getattr(obj, 'favorited', None)
+        if favorited is None:
+            return obj.is_favorited(request.user)
+        return favorited
 
     def get_is_in_shopping_cart(self, obj):
         """Определяем, находится ли рецепт в корзине пользователя."""
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return obj.is_in_shopping_cart(request.user)
+        in_shopping_cart = getattr(obj, 'in_shopping_cart', None)
+        if in_shopping_cart is None:
+            return obj.is_in_shopping_cart(request.user)
+        return in_shopping_cart
 
 
 class RecipeCreateSerializer(RecipeSerializer):
@@ -240,38 +452,101 @@ class RecipeCreateSerializer(RecipeSerializer):
 
     def create(self, validated_data):
         """Создание нового рецепта с сохранением связанных тегов и
-        иенредиентов."""
+        иенредиентов. Поисковый вектор считается один раз, после записи
+        ингредиентов (сигналы его не пересчитывают). Рецепт и связи
+        пишутся одной транзакцией: иначе кэш рецепта мог бы сохранить
+        его без тегов и ингредиентов до следующего изменения."""
         request = self.context.get('request')
         author = request.user
         validated_data['author'] = author
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('recipeingredients')
-        recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
-        self.create_recipe_ingredient(recipe, ingredients)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(**validated_data)
+            recipe.tags.set(tags)
+            self.create_recipe_ingredient(recipe, {
+                ing['id']: ing['amount'] for ing in ingredients})
+            Recipe.update_search_vector(pk=recipe.pk)
+        bump_version(RECIPES_VERSION)
+        schedule_variants(recipe.pk)
+        FeedItem.publish(recipe)
         return recipe
 
     def update(self, instance, validated_data):
-        """Изменение рецепта с обновлением связанных тегов и
-        ингредиентов."""
+        """Изменение рецепта: связанные теги и ингредиенты меняем
+        по разнице с текущими (изменившиеся количества обновляем,
+        лишние строки удаляем, недостающие добавляем), затем один раз
+        пересчитываем поисковый вектор."""
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('recipeingredients')
-        instance.ingredients.clear()
-        instance.tags.clear()
-        super().update(instance, validated_data)
-        instance.tags.set(tags)
-        self.create_recipe_ingredient(instance, ingredients)
+        new_amounts = {ing['id']: ing['amount'] for ing in ingredients}
+        stale_variants = None
+        if 'image' in validated_data:
+            stale_variants = instance.image_variants
+            validated_data['image_variants'] = {}
+        with transaction.atomic():
+            current = {
+                item.ingredient_id: item
+                for item in instance.recipeingredients.all()
+            }
+            old_amounts = {
+                ingredient_id: item.amount
+                for ingredient_id, item in current.items()
+            }
+            super().update(instance, validated_data)
+            if stale_variants is not None:
+                schedule_variants(instance.pk, stale_variants)
+            instance.tags.set(tags)
+            self.update_recipe_ingredients(instance, current, new_amounts)
+            Recipe.update_search_vector(pk=instance.pk)
+            ShoppingListIngredient.update_recipe(
+                instance, old_amounts, new_amounts)
+        bump_version(RECIPES_VERSION)
         return instance
 
-    def create_recipe_ingredient(self, recipe, ingredients):
-        """Доп.функция: создаем связку рецепт<->ингредиент."""
+    def update_recipe_ingredients(self, recipe, current, new_amounts):
+        """Доп.функция: приводим связку рецепт<->ингредиент к новому
+        составу. `current` - текущие строки по id ингредиента,
+        `new_amounts` - новые количества по id ингредиента."""
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != item.amount:
+                item.amount = amount
+                changed.append(item)
+        if changed:
+            RecipeIngredients.objects.bulk_update(changed, ['amount'])
+        removed = [
+            item.pk for ingredient_id, item in current.items()
+            if ingredient_id not in new_amounts
+        ]
+        if removed:
+            RecipeIngredients.objects.filter(pk__in=removed).delete()
+        self.create_recipe_ingredient(recipe, {
+            ingredient_id: amount
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in current
+        })
+
+    def save(self, **kwargs):
+        """Закрываем временный файл загруженного фото после сохранения."""
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if isinstance(image, TemporaryUploadedFile):
+                image.close()
+
+    def create_recipe_ingredient(self, recipe, amounts):
+        """Доп.функция: создаем связку рецепт<->ингредиент
+        (`amounts` - количества по id ингредиента)."""
         recipe_ingredients = [
             RecipeIngredients(
                 recipe=recipe,
-                ingredient_id=ing['id'],
-                amount=ing['amount']
+                ingredient_id=ingredient_id,
+                amount=amount
             )
-            for ing in ingredients
+            for ingredient_id, amount in amounts.items()
         ]
         RecipeIngredients.objects.bulk_create(recipe_ingredients)
 
@@ -287,19 +562,6 @@ class FavoriteSerializer(serializers.ModelSerializer):
             'cooking_time': {'required': False},
         }
 
-    def validate(self, data):
-        request = self.context.get('request')
-        recipe = self.instance
-        favorite = Favorite.objects.filter(
-            user=request.user, recipe=recipe).exists()
-        if request.method == 'DELETE' and not favorite:
-            raise serializers.ValidationError(
-                'Рецепт уже удален из избранного.')
-        if favorite:
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в избранное.')
-        return data
-
 
 class ShoppingCartSerializer(serializers.ModelSerializer):
     """Сериализатор корзины покупок."""
@@ -312,15 +574,45 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
             'cooking_time': {'required': False},
         }
 
+
+class PantrySerializer(serializers.Serializer):
+    """Сериализатор параметров поиска рецептов по имеющимся
+    продуктам."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=settings.PANTRY_MAX_INGREDIENTS
+    )
+    max_missing = serializers.IntegerField(min_value=0, default=0)
+    tags = serializers.ListField(child=serializers.SlugField(), default=list)
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.PANTRY_RECIPES_MAX_LIMIT,
+        default=settings.PANTRY_RECIPES_LIMIT
+    )
+
+
+class BatchSerializer(serializers.Serializer):
+    """Сериализатор пакета id для добавления (`add`)
+    и удаления (`remove`)."""
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        default=list,
+        max_length=settings.BATCH_MAX_SIZE
+    )
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        default=list,
+        max_length=settings.BATCH_MAX_SIZE
+    )
+
     def validate(self, data):
-        request = self.context.get('request')
-        recipe = self.instance
-        shopping_cart = ShoppingCart.objects.filter(
-            user=request.user, recipe=recipe).exists()
-        if request.method == 'DELETE' and not shopping_cart:
+        if not data['add'] and not data['remove']:
             raise serializers.ValidationError(
-                'Рецепт уже удален из корзины покупок.')
-        if shopping_cart:
+                'Необходимо указать `add` или `remove`.')
+        if set(data['add']) & set(data['remove']):
             raise serializers.ValidationError(
-                'Рецепт уже добавлен в корзину покупок.')
+                'Один и тот же id нельзя добавить и удалить в одном пакете.')
+        data['add'] = list(dict.fromkeys(data['add']))
+        data['remove'] = list(dict.fromkeys(data['remove']))
         return data
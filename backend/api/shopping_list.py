@@ -0,0 +1,102 @@
+import csv
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfgen import canvas
+
+TITLE = 'Список продуктов:'
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 18
+PDF_CHUNK_SIZE = 8192
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: строка не копится, а сразу
+    возвращается генератору."""
+    def write(self, value):
+        return value
+
+
+def ingredient_line(ingredient):
+    """Строка списка покупок для одного ингредиента."""
+    return '{0} ({1}) - {2}'.format(
+        ingredient['ingredient__name'],
+        ingredient['ingredient__measurement_unit'],
+        ingredient['total_amount'],
+    )
+
+
+def render_txt(ingredients):
+    """Список покупок в формате txt."""
+    yield f'{TITLE} \n'
+    for ingredient in ingredients:
+        yield f'{ingredient_line(ingredient)} \n'
+
+
+def render_csv(ingredients):
+    """Список покупок в формате csv."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['total_amount'],
+        ))
+
+
+def get_pdf_font():
+    """Регистрируем шрифт с поддержкой кириллицы. Стандартные шрифты
+    PDF кириллицу не отображают, поэтому без шрифта выгрузка в pdf
+    невозможна."""
+    if PDF_FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return PDF_FONT_NAME
+    try:
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT))
+    except TTFError as error:
+        raise ImproperlyConfigured(
+            'Не найден шрифт для списка покупок в pdf '
+            '(SHOPPING_LIST_PDF_FONT): {0}'.format(error))
+    return PDF_FONT_NAME
+
+
+def iter_chunks(buffer):
+    """Доп.функция: читаем буфер частями по `PDF_CHUNK_SIZE`."""
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
+
+
+def render_pdf(ingredients):
+    """Список покупок в формате pdf. Документ собирается в памяти
+    целиком (ReportLab пишет файл только при сохранении) и затем
+    отдается частями; ошибка шрифта возникает до начала ответа."""
+    buffer = BytesIO()
+    font = get_pdf_font()
+    width, height = A4
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.setFont(font, 14)
+    y = height - PDF_MARGIN
+    pdf.drawString(PDF_MARGIN, y, TITLE)
+    pdf.setFont(font, 11)
+    for ingredient in ingredients:
+        y -= PDF_LINE_HEIGHT
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont(font, 11)
+            y = height - PDF_MARGIN
+        pdf.drawString(PDF_MARGIN, y, ingredient_line(ingredient))
+    pdf.save()
+    return iter_chunks(buffer)
+
+
+EXPORT_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
@@ -0,0 +1,177 @@
+import re
+
+from django.contrib.admin.sites import site
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from recipes.models import Ingredient, Recipe, RecipeIngredients, Tag
+from recipes.testing import PNG, MediaTestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import Subscription, User
+
+WRITE_SQL = re.compile(r'(INSERT|UPDATE|DELETE)\b[^"]*"(\w+)"')
+
+
+def writes(queries):
+    """Доп.функция: изменяющие запросы в виде (команда, таблица)."""
+    return [
+        match.groups() for match in (
+            WRITE_SQL.match(query['sql']) for query in queries)
+        if match
+    ]
+
+
+class BaseRecipeTest(MediaTestCase):
+    """Общие данные: пользователь, подписанный на автора, теги
+    и ингредиенты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pw')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw')
+        Subscription.objects.create(user=cls.user, author=cls.author)
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {i}', color=f'#00000{i}',
+                               slug=f'tag{i}')
+            for i in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token {0}'.format(
+            Token.objects.create(user=self.user).key))
+
+    def create_recipes(self, count, author=None):
+        Recipe.objects.all().delete()
+        for i in range(count):
+            recipe = Recipe.objects.create(
+                author=author or self.author, name=f'Рецепт {i}',
+                text='Описание', cooking_time=5,
+                image=ContentFile(PNG, name='image.png'))
+            recipe.tags.set(self.tags)
+            RecipeIngredients.objects.bulk_create(
+                RecipeIngredients(recipe=recipe, ingredient=ingredient,
+                                  amount=10)
+                for ingredient in self.ingredients
+            )
+        return Recipe.objects.first()
+
+
+class RecipeQueriesTest(BaseRecipeTest):
+    """Число запросов к БД для списка и рецепта не зависит
+    от количества рецептов на странице."""
+    # Холодный кэш: токен, версии, COUNT, страница, общие части
+    # рецептов (рецепты, теги, ингредиенты), избранное, корзина,
+    # подписки. Теплый кэш: без токена и общих частей.
+    LIST_COLD_QUERIES = 10
+    LIST_WARM_QUERIES = 6
+    # Токен (на холодном кэше), ETag (дата изменения и версии),
+    # рецепт с признаками, теги, ингредиенты.
+    DETAIL_COLD_QUERIES = 6
+    DETAIL_WARM_QUERIES = 5
+
+    def test_list_queries(self):
+        for count in (1, 10, 100):
+            with self.subTest(count=count):
+                self.create_recipes(count)
+                cache.clear()
+                url = f'/api/recipes/?limit={count}'
+                with self.assertNumQueries(self.LIST_COLD_QUERIES):
+                    response = self.client.get(url)
+                self.assertEqual(len(response.data['results']), count)
+                with self.assertNumQueries(self.LIST_WARM_QUERIES):
+                    response = self.client.get(url)
+                self.assertEqual(len(response.data['results']), count)
+
+    def test_detail_queries(self):
+        for count in (1, 10, 100):
+            with self.subTest(count=count):
+                recipe = self.create_recipes(count)
+                cache.clear()
+                url = f'/api/recipes/{recipe.pk}/'
+                with self.assertNumQueries(self.DETAIL_COLD_QUERIES):
+                    response = self.client.get(url)
+                self.assertEqual(response.data['id'], recipe.pk)
+                self.assertTrue(response.data['author']['is_subscribed'])
+                with self.assertNumQueries(self.DETAIL_WARM_QUERIES):
+                    self.client.get(url)
+
+
+class RecipeUpdateWritesTest(BaseRecipeTest):
+    """Изменение рецепта пишет только изменившиеся связи."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipes(1, author=self.user)
+        self.payload = {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 5,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 10}
+                for ingredient in self.ingredients
+            ],
+        }
+
+    def patch(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/', self.payload,
+                format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return writes(context.captured_queries)
+
+    def test_title_only_update(self):
+        self.payload['name'] = 'Новое название'
+        tables = {table for _, table in self.patch()}
+        self.assertNotIn('recipes_recipeingredients', tables)
+        self.assertNotIn('recipes_recipe_tags', tables)
+
+    def test_amount_only_update(self):
+        self.payload['ingredients'][0]['amount'] = 25
+        changes = self.patch()
+        self.assertIn(('UPDATE', 'recipes_recipeingredients'), changes)
+        for command in ('INSERT', 'DELETE'):
+            self.assertNotIn((command, 'recipes_recipeingredients'), changes)
+            self.assertNotIn((command, 'recipes_recipe_tags'), changes)
+        self.assertEqual(
+            RecipeIngredients.objects.get(
+                recipe=self.recipe, ingredient=self.ingredients[0]).amount,
+            25
+        )
+
+
+class RecipeCacheInvalidationTest(BaseRecipeTest):
+    """Изменение состава рецепта в admin обновляет ETag рецепта
+    и общую часть рецепта в кэше списка."""
+
+    def get_amount(self, data):
+        return {
+            item['id']: item['amount'] for item in data['ingredients']
+        }[self.ingredients[0].pk]
+
+    def test_admin_ingredient_change(self):
+        recipe = self.create_recipes(1)
+        detail = self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.client.get('/api/recipes/')
+        item = RecipeIngredients.objects.get(
+            recipe=recipe, ingredient=self.ingredients[0])
+        item.amount = 99
+        site._registry[RecipeIngredients].save_model(
+            RequestFactory().post('/'), item, None, True)
+        response = self.client.get(
+            f'/api/recipes/{recipe.pk}/', HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_amount(response.data), 99)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(self.get_amount(response.data['results'][0]), 99)
@@ -16,8 +16,14 @@ urlpatterns = [
     path('users/set_password/', ChangePasswordView.as_view()),
     path('users/subscriptions/', SubscriptionsViewSet.as_view(
         {'get': 'subscriptions'})),
+    path('users/subscribe/batch/', SubscriptionsViewSet.as_view(
+        {'post': 'subscribe_batch'})),
     path('users/<int:pk>/subscribe/', SubscriptionsViewSet.as_view(
         {'post': 'subscribe', 'delete': 'subscribe'})),
+    path('recipes/favorite/batch/', FavoriteViewSet.as_view(
+        {'post': 'favorite_batch'})),
+    path('recipes/shopping_cart/batch/', ShoppingCartViewSet.as_view(
+        {'post': 'shopping_cart_batch'})),
     path('recipes/<int:pk>/favorite/', FavoriteViewSet.as_view(
         {'post': 'favorite', 'delete': 'favorite'})),
     path('recipes/<int:pk>/shopping_cart/', ShoppingCartViewSet.as_view(
@@ -1,24 +1,47 @@
 from collections import defaultdict
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.db.models import Count, Exists, F, OuterRef, Q, Value, Window
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredients,
-                            ShoppingCart, Tag)
+from recipes.cache import (INGREDIENTS_VERSION, RECIPES_VERSION, TAGS_VERSION,
+                           get_version, get_versions)
+from recipes.db import insert_ignore
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (Favorite, FeedItem, Ingredient, Recipe,
+                            ShoppingCart, ShoppingListIngredient, Tag)
+from recipes.recipe_index import recipe_index
+from recipes.tag_index import tag_index
 from rest_framework import mixins, permissions, status, views, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from users.models import Subscription, User
 
 from .filters import IngredientFilter, RecipeFilter
-from .paginators import CustomPageNumberPagination
+from .mixins import (AnonymousListCacheMixin, BatchRelationMixin,
+                     ConditionalGetMixin)
+from .paginators import (CustomCursorPagination, CustomPageNumberPagination,
+                         FeedCursorPagination, RecipeCursorPagination)
 from .permissions import IsAdminOrReadOnly, IsAuthorOrReadOnly
-from .serializers import (ChangePasswordSerializer, CustomUserCreateSerializer,
-                          CustomUserSerializer, FavoriteSerializer,
-                          IngredientSerializer, RecipeCreateSerializer,
-                          RecipeSerializer, ShoppingCartSerializer,
+from .serializers import (CachedRecipeListSerializer, ChangePasswordSerializer,
+                          CustomUserCreateSerializer, CustomUserSerializer,
+                          FavoriteSerializer, IngredientSerializer,
+                          PantryRecipeSerializer, PantrySerializer,
+                          RecipeCreateSerializer, RecipeSerializer,
+                          ShoppingCartSerializer, SimilarRecipeSerializer,
                           SubscriptionSerializer, TagSerializer)
+from .shopping_list import EXPORT_FORMATS
+
+
+def relation_error(message):
+    """Доп.функция: ошибка добавления/удаления связи в том же формате,
+    что и ошибки валидации сериализатора."""
+    return ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
 
 
 class CustomUserViewSet(
@@ -28,44 +51,111 @@ class CustomUserViewSet(
     """Кастомный Viewset для пользователя."""
     queryset = User.objects.all()
     permission_classes = [permissions.AllowAny]
+    pagination_class = CustomPageNumberPagination
+    cursor_pagination_class = CustomCursorPagination
+
+    def get_queryset(self):
+        """Для авторизованного пользователя аннотируем признак подписки
+        одним подзапросом на страницу."""
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(
+            subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('pk'))),
+        )
 
     def get_serializer_class(self):
         if self.action == 'create':
             return CustomUserCreateSerializer
         return CustomUserSerializer
 
-    def list(self, request):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
-
 
-class SubscriptionsViewSet(viewsets.ModelViewSet):
+class SubscriptionsViewSet(BatchRelationMixin, viewsets.ModelViewSet):
     """Viewset для подписки на авторов."""
+    pagination_class = CustomPageNumberPagination
+    cursor_pagination_class = CustomCursorPagination
+    batch_model = Subscription
+    batch_target_model = User
+    batch_field = 'author'
+
     @action(detail=False, permission_classes=[permissions.IsAuthenticated])
     def subscriptions(self, request):
-        queryset = User.objects.filter(following__user=request.user)
+        queryset = User.objects.filter(
+            following__user=request.user).annotate(
+                recipes_count=Count('recipes'),
+                subscribed=Value(True)).order_by('id')
         page = self.paginate_queryset(queryset)
-        serializer = SubscriptionSerializer(page, many=True,
-                                            context={'request': request})
+        author_recipes = self.get_author_recipes(
+            page, SubscriptionSerializer.get_recipes_limit(request))
+        serializer = SubscriptionSerializer(
+            page, many=True,
+            context={'request': request, 'author_recipes': author_recipes})
         return self.get_paginated_response(serializer.data)
 
+    def get_author_recipes(self, authors, recipes_limit=None) -> dict:
+        """Доп.функция: одним запросом выбираем рецепты авторов страницы
+        (не больше `recipes_limit` последних рецептов на автора)."""
+        if not authors:
+            return {}
+        recipes = Recipe.objects.filter(
+            author__in=[author.id for author in authors])
+        if recipes_limit is not None:
+            ranked = recipes.annotate(recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('author')],
+                order_by=[F('pub_date').desc(), F('name').asc()],
+            )).order_by()
+            sql, params = ranked.query.sql_with_params()
+            recipes = Recipe.objects.raw(
+                f'SELECT * FROM ({sql}) ranked '
+                'WHERE recipe_rank <= %s ORDER BY recipe_rank',
+                (*params, recipes_limit)
+            )
+        author_recipes = defaultdict(list)
+        for recipe in recipes:
+            author_recipes[recipe.author_id].append(recipe)
+        return author_recipes
+
     @action(methods=['post', 'delete'], detail=True,
             permission_classes=[permissions.IsAuthenticated])
     def subscribe(self, request, pk):
-        author = get_object_or_404(User, id=pk)
-        subscription = Subscription.objects.filter(user=request.user,
-                                                   author=author).first()
-        serializer = SubscriptionSerializer(author, data=request.data,
-                                            context={'request': request})
-        if request.method == 'DELETE' and subscription:
-            subscription.delete()
+        if request.method == 'DELETE':
+            deleted, _ = Subscription.objects.filter(
+                user=request.user, author_id=pk).delete()
+            if not deleted:
+                get_object_or_404(User, id=pk)
+                raise relation_error('Подписка уже удалена.')
+            FeedItem.unfollow(request.user, [pk])
             return Response({'message': 'Подписка на автора успешно удалена.'},
                             status=status.HTTP_204_NO_CONTENT)
-        serializer.is_valid(raise_exception=True)
-        Subscription.objects.create(user=request.user, author=author)
+        author = get_object_or_404(User, id=pk)
+        if author == request.user:
+            raise relation_error('Вы не можете подписаться на самого себя.')
+        if not insert_ignore(
+                Subscription, user_id=request.user.pk, author_id=author.pk):
+            raise relation_error('Вы уже подписаны на этого автора.')
+        FeedItem.follow(request.user, [author.pk])
+        author.subscribed = True
+        serializer = SubscriptionSerializer(
+            author, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(methods=['post'], detail=False,
+            permission_classes=[permissions.IsAuthenticated])
+    def subscribe_batch(self, request):
+        """Подписываемся на авторов `add` и отписываемся
+        от авторов `remove` одним запросом."""
+        return self.apply_batch(request)
+
+    def get_batch_invalid_ids(self, request):
+        return {request.user.pk}
+
+    def batch_applied(self, request, added, removed):
+        FeedItem.follow(request.user, added)
+        FeedItem.unfollow(request.user, removed)
+
 
 class CurrentUserMeView(views.APIView):
     """View для просмотра текущего пользователя (себя)."""
@@ -96,15 +186,19 @@ class ChangePasswordView(views.APIView):
                         status=status.HTTP_200_OK)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """Viewset для тега."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = None
 
+    def get_conditions(self, request):
+        version = get_version(TAGS_VERSION)
+        return (TAGS_VERSION, version), version // 10 ** 9
+
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """Viewset для ингредиента."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -113,88 +207,269 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
 
+    def get_conditions(self, request):
+        version = get_version(INGREDIENTS_VERSION)
+        return (INGREDIENTS_VERSION, version), version // 10 ** 9
 
-class RecipeViewSet(viewsets.ModelViewSet):
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.list_from_index, request, *args, **kwargs)
+
+    def list_from_index(self, request, *args, **kwargs):
+        """Отдаем ингредиенты из индекса в памяти, без запроса к БД."""
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return Response(ingredient_index.all())
+
+
+class RecipeViewSet(
+    AnonymousListCacheMixin, ConditionalGetMixin, viewsets.ModelViewSet
+):
     """Viewset для рецепта."""
-    queryset = Recipe.objects.prefetch_related(
-        'author', 'tags', 'ingredients').all()
+    queryset = RecipeSerializer.setup_queryset(Recipe.objects.all())
     permission_classes = [IsAuthorOrReadOnly]
     pagination_class = CustomPageNumberPagination
+    cursor_pagination_class = RecipeCursorPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    conditional_actions = ('retrieve',)
+    list_cache_params = (
+        'tags', 'author', 'page', 'limit', 'search', 'ordering', 'cursor')
+    list_cache_timeout = settings.RECIPE_LIST_CACHE_TIMEOUT
+
+    def get_list_cache_versions(self):
+        return get_versions(
+            RECIPES_VERSION, TAGS_VERSION, INGREDIENTS_VERSION)
+
+    def get_conditions(self, request):
+        """ETag рецепта зависит от даты его изменения и изменения
+        профиля автора, версий тегов и ингредиентов и от признаков
+        избранного, корзины и подписки текущего пользователя."""
+        user = request.user
+        flags = () if user.is_anonymous else (
+            'favorited', 'in_shopping_cart', 'author_subscribed')
+        try:
+            recipe = self.get_queryset().prefetch_related(None).filter(
+                pk=self.kwargs['pk']).values(
+                    'modified_at', 'author__modified_at', *flags).first()
+        except (TypeError, ValueError):
+            return None, None
+        if recipe is None:
+            return None, None
+        modified_at = max(
+            recipe.pop('modified_at'),
+            recipe.pop('author__modified_at')
+        ).timestamp()
+        etag_parts = (
+            'recipe', self.kwargs['pk'], modified_at,
+            *get_versions(TAGS_VERSION, INGREDIENTS_VERSION),
+            user.id, *recipe.values(),
+        )
+        if user.is_anonymous:
+            return etag_parts, int(modified_at)
+        return etag_parts, None
+
+    def get_queryset(self):
+        """Для списка выбираем только ключевые поля: остальное подставит
+        CachedRecipeListSerializer. Для отдельного рецепта аннотируем
+        признаки избранного, корзины и подписки на автора."""
+        if self.action == 'list':
+            return CachedRecipeListSerializer.setup_queryset(
+                Recipe.objects.all())
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(
+            favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author'))),
+        )
 
     def get_serializer_class(self):
         if self.request.method in permissions.SAFE_METHODS:
             return RecipeSerializer
         return RecipeCreateSerializer
 
+    @action(detail=True)
+    def similar(self, request, pk):
+        """Похожие рецепты: наибольшее сходство Жаккара по ингредиентам
+        и тегам (количество задается параметром `limit`)."""
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = settings.SIMILAR_RECIPES_LIMIT
+        limit = min(max(limit, 1), settings.SIMILAR_RECIPES_CANDIDATES)
+        scores = recipe_index.similar(recipe.pk, limit)
+        recipes = Recipe.objects.in_bulk([pk for pk, _ in scores])
+        similar = []
+        for pk, score in scores:
+            if pk in recipes:
+                recipes[pk].similarity = round(score, 3)
+                similar.append(recipes[pk])
+        serializer = SimilarRecipeSerializer(
+            similar, many=True, context={'request': request})
+        return Response(serializer.data)
+
+    @action(detail=False)
+    def pantry(self, request):
+        """Рецепты из имеющихся продуктов: id ингредиентов передаются
+        в `ingredients` через запятую, `max_missing` - сколько
+        ингредиентов может не хватать, `tags` - слаги тегов."""
+        params = request.query_params
+        serializer = PantrySerializer(data={
+            'ingredients': [
+                value for values in params.getlist('ingredients')
+                for value in values.split(',') if value
+            ],
+            'max_missing': params.get('max_missing', 0),
+            'tags': params.getlist('tags'),
+            'limit': params.get('limit', settings.PANTRY_RECIPES_LIMIT),
+        })
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        tag_ids = tag_index.ids(data['tags']) if data['tags'] else None
+        matches = recipe_index.pantry(
+            data['ingredients'], data['max_missing'], tag_ids, data['limit'])
+        recipes = Recipe.objects.in_bulk([pk for pk, _, _ in matches])
+        pantry = []
+        for pk, coverage, missing in matches:
+            if pk in recipes:
+                recipes[pk].coverage = round(coverage, 3)
+                recipes[pk].missing = missing
+                pantry.append(recipes[pk])
+        serializer = PantryRecipeSerializer(
+            pantry, many=True, context={'request': request})
+        return Response(serializer.data)
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь:
+        рецепты из таблицы ленты и рецепты авторов, чья лента
+        собирается при чтении."""
+        recipes = CachedRecipeListSerializer.setup_queryset(
+            Recipe.objects.all())
+        sources = [(
+            recipes,
+            Q(feed_items__user=request.user),
+            ('-feed_items__pub_date', '-feed_items__recipe_id'),
+        )]
+        authors = list(User.objects.filter(
+            following__user=request.user, feed_on_read=True).values_list(
+                'id', flat=True))
+        if authors:
+            sources.append(
+                (recipes, Q(author__in=authors), ('-pub_date', '-id')))
+        paginator = FeedCursorPagination()
+        page = paginator.paginate_sources(sources, request, self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-class FavoriteViewSet(viewsets.ModelViewSet):
+
+class FavoriteViewSet(BatchRelationMixin, viewsets.ModelViewSet):
     """Viewset для избранного."""
+    batch_model = Favorite
+    batch_target_model = Recipe
+    batch_field = 'recipe'
+
     @action(methods=['post', 'delete'], detail=True)
     def favorite(self, request, pk):
         """Действия с избранным: добавляем/удаляем рецепт."""
-        recipe = get_object_or_404(Recipe, id=pk)
-        favorite = Favorite.objects.filter(user=request.user,
-                                           recipe=recipe).first()
-        serializer = FavoriteSerializer(recipe, data=request.data,
-                                        context={'request': request})
-        if request.method == 'DELETE' and favorite:
-            favorite.delete()
+        if request.method == 'DELETE':
+            deleted, _ = Favorite.objects.filter(
+                user=request.user, recipe_id=pk).delete()
+            if not deleted:
+                get_object_or_404(Recipe, id=pk)
+                raise relation_error('Рецепт уже удален из избранного.')
+            Recipe.change_counter(pk, 'favorites_count', -1)
             return Response({'message': 'Рецепт успешно удален из избранного'},
                             status=status.HTTP_204_NO_CONTENT)
-        serializer.is_valid(raise_exception=True)
-        Favorite.objects.create(user=request.user, recipe=recipe)
+        recipe = get_object_or_404(Recipe, id=pk)
+        if not insert_ignore(
+                Favorite, user_id=request.user.pk, recipe_id=recipe.pk):
+            raise relation_error('Рецепт уже добавлен в избранное.')
+        Recipe.change_counter(recipe.pk, 'favorites_count', 1)
+        serializer = FavoriteSerializer(recipe, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(methods=['post'], detail=False)
+    def favorite_batch(self, request):
+        """Добавляем рецепты `add` в избранное и удаляем
+        рецепты `remove` одним запросом."""
+        return self.apply_batch(request)
+
+    def batch_applied(self, request, added, removed):
+        Recipe.change_counters(added, 'favorites_count', 1)
+        Recipe.change_counters(removed, 'favorites_count', -1)
 
-class ShoppingCartViewSet(viewsets.ModelViewSet):
+
+class ShoppingCartViewSet(BatchRelationMixin, viewsets.ModelViewSet):
     """Viewset для корзины покупок."""
+    batch_model = ShoppingCart
+    batch_target_model = Recipe
+    batch_field = 'recipe'
+
     @action(methods=['post', 'delete'], detail=True)
     def shopping_cart(self, request, pk):
         """Действия с корзиной: добавляем/удаляем рецепт."""
-        recipe = get_object_or_404(Recipe, id=pk)
-        shopping_cart = ShoppingCart.objects.filter(user=request.user,
-                                                    recipe=recipe).first()
-        serializer = ShoppingCartSerializer(recipe, data=request.data,
-                                            context={'request': request})
-        if request.method == 'DELETE' and shopping_cart:
-            shopping_cart.delete()
+        if request.method == 'DELETE':
+            deleted, _ = ShoppingCart.objects.filter(
+                user=request.user, recipe_id=pk).delete()
+            if not deleted:
+                get_object_or_404(Recipe, id=pk)
+                raise relation_error('Рецепт уже удален из корзины покупок.')
+            Recipe.change_counter(pk, 'in_carts_count', -1)
+            ShoppingListIngredient.apply_recipes(request.user, removed=[pk])
             return Response({'message': 'Рецепт успешно удален из корзины'},
                             status=status.HTTP_204_NO_CONTENT)
-        serializer.is_valid(raise_exception=True)
-        ShoppingCart.objects.create(user=request.user, recipe=recipe)
+        recipe = get_object_or_404(Recipe, id=pk)
+        if not insert_ignore(
+                ShoppingCart, user_id=request.user.pk, recipe_id=recipe.pk):
+            raise relation_error('Рецепт уже добавлен в корзину покупок.')
+        Recipe.change_counter(recipe.pk, 'in_carts_count', 1)
+        ShoppingListIngredient.add_recipe(request.user, recipe)
+        serializer = ShoppingCartSerializer(
+            recipe, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(methods=['post'], detail=False)
+    def shopping_cart_batch(self, request):
+        """Добавляем рецепты `add` в корзину и удаляем рецепты
+        `remove` одним запросом (например, при синхронизации
+        корзины, собранной офлайн)."""
+        return self.apply_batch(request)
+
+    def batch_applied(self, request, added, removed):
+        Recipe.change_counters(added, 'in_carts_count', 1)
+        Recipe.change_counters(removed, 'in_carts_count', -1)
+        ShoppingListIngredient.apply_recipes(request.user, added, removed)
+
     @action(methods=['get'], detail=False,
             permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        """Выгружаем список продуктов из корзины (формат txt)."""
-        ingredients = RecipeIngredients.objects.filter(
-            recipe__shopping_cart__user=request.user).values(
+        """Выгружаем список продуктов из корзины
+        (формат задается параметром `type`: txt, csv или pdf)."""
+        file_format = request.query_params.get('type', 'txt')
+        if file_format not in EXPORT_FORMATS:
+            return Response(
+                {'errors': 'Допустимые форматы: {0}.'.format(
+                    ', '.join(EXPORT_FORMATS))},
+                status=status.HTTP_400_BAD_REQUEST)
+        render, content_type = EXPORT_FORMATS[file_format]
+        ingredients = ShoppingListIngredient.objects.filter(
+            user=request.user).values(
                 'ingredient__name',
                 'ingredient__measurement_unit',
-                'amount').order_by('ingredient__name')
-        shopping_list = self.create_ingredient_list(ingredients)
-        response = HttpResponse(shopping_list, content_type='text/plain')
+                total_amount=F('amount')).order_by('ingredient__name')
+        response = StreamingHttpResponse(
+            render(ingredients.iterator()), content_type=content_type)
         response['Content-Disposition'] = (
-            'attachment; filename={0}'.format('Список_покупок.txt')
+            'attachment; filename={0}'.format(
+                f'Список_покупок.{file_format}')
         )
         return response
-
-    def create_ingredient_list(self, queryset) -> list:
-        """Доп.функция: создаем список продуктов по рецептам из корзины."""
-        ingredient_data = defaultdict(int)
-        for ingredient in queryset:
-            ingredient_name = ingredient['ingredient__name']
-            measurement_unit = ingredient['ingredient__measurement_unit']
-            amount = ingredient['amount']
-            key = f'{ingredient_name} ({measurement_unit})'
-            ingredient_data[key] += amount
-
-        ingredient_list = []
-        ingredient_list.append('Список продуктов: \n')
-        for ingredient, amount in ingredient_data.items():
-            ingredient_list.append(f'{ingredient} - {amount} \n')
-
-        return ingredient_list
@@ -124,6 +124,28 @@ USE_TZ = True
 MAX_LENGTH_RECIPES = 200
 MAX_LENGTH_USER = 150
 
+INGREDIENT_SEARCH_LIMIT = 50
+
+BATCH_MAX_SIZE = 100
+
+FEED_FANOUT_LIMIT = 1000
+
+SIMILAR_RECIPES_LIMIT = 10
+SIMILAR_RECIPES_CANDIDATES = 200
+RECIPE_INDEX_MAX_POSTING = 50000
+RECIPE_INDEX_REBUILD_THRESHOLD = 10000
+
+PANTRY_RECIPES_LIMIT = 20
+PANTRY_RECIPES_MAX_LIMIT = 100
+PANTRY_MAX_INGREDIENTS = 100
+
+SEARCH_CONFIG = 'russian'
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
@@ -131,15 +153,40 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+RECIPE_IMAGE_VARIANTS = {
+    'thumb': (480, 480),
+    'large': (1280, 1280),
+}
+RECIPE_IMAGE_LIST_VARIANT = 'thumb'
+RECIPE_IMAGE_DETAIL_VARIANT = 'large'
+RECIPE_IMAGE_QUALITY = 80
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', 5 * 1024 * 1024))
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+RECIPE_LIST_CACHE_TIMEOUT = 60 * 10
+RECIPE_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+# С LocMemCache выход из аккаунта в одном процессе не виден в других
+# до истечения этого времени: при нескольких процессах нужен общий кэш.
+AUTH_TOKEN_CACHE_TIMEOUT = 60
+
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
         # 'rest_framework.authentication.BasicAuthentication',
         # 'rest_framework.authentication.SessionAuthentication',        
     ],
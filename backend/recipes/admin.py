@@ -1,18 +1,30 @@
 from django.contrib import admin
+from django.db import transaction
+from django.utils import timezone
 
-from .models import (Favorite, Ingredient, Recipe, RecipeIngredients,
-                     ShoppingCart, Tag)
+from .cache import RECIPES_VERSION, bump_version
+from .models import (Favorite, FeedItem, Ingredient, Recipe, RecipeIngredients,
+                     ShoppingCart, ShoppingListIngredient, Tag)
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     """Управление рецептами в admin."""
 
-    list_display = ('id', 'name', 'author', 'text', 'cooking_time', 'pub_date')
+    list_display = (
+        'id', 'name', 'author', 'text', 'cooking_time', 'pub_date',
+        'favorites_count', 'in_carts_count',
+    )
     search_fields = ('name', 'author')
     list_filter = ('name', 'author', 'tags')
     empty_value_display = '-пусто-'
 
+    def save_related(self, request, form, formsets, change):
+        """Поисковый вектор рецепта пересчитываем после сохранения
+        связей (API делает это в RecipeCreateSerializer)."""
+        super().save_related(request, form, formsets, change)
+        Recipe.update_search_vector(pk=form.instance.pk)
+
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
@@ -43,6 +55,47 @@ class RecipeIngredientsAdmin(admin.ModelAdmin):
     list_filter = ('recipe', 'ingredient')
     empty_value_display = '-пусто-'
 
+    def recipe_ingredients_changed(self, old, new):
+        """Доп.функция: переносим замену строки состава `old` на `new`
+        (любая может быть None) в списки покупок и поисковые векторы
+        рецептов, меняем дату изменения рецептов (ETag и кэш рецепта)
+        и версию каталога."""
+        amounts = {}
+        if old is not None:
+            amounts.setdefault(old.recipe_id, ({}, {}))[0][
+                old.ingredient_id] = old.amount
+        if new is not None:
+            amounts.setdefault(new.recipe_id, ({}, {}))[1][
+                new.ingredient_id] = new.amount
+        for recipe_id, (old_amounts, new_amounts) in amounts.items():
+            ShoppingListIngredient.update_recipe(
+                Recipe(pk=recipe_id), old_amounts, new_amounts)
+        recipe_ids = list(amounts)
+        Recipe.update_search_vector(pk__in=recipe_ids)
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            modified_at=timezone.now())
+        bump_version(RECIPES_VERSION)
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            old = None
+            if change:
+                old = RecipeIngredients.objects.filter(pk=obj.pk).first()
+            super().save_model(request, obj, form, change)
+            self.recipe_ingredients_changed(old, obj)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            self.recipe_ingredients_changed(obj, None)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            items = list(queryset)
+            super().delete_queryset(request, queryset)
+            for item in items:
+                self.recipe_ingredients_changed(item, None)
+
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
@@ -62,3 +115,22 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     search_fields = ('user', 'recipe')
     list_filter = ('user', 'recipe')
     empty_value_display = '-пусто-'
+
+
+@admin.register(ShoppingListIngredient)
+class ShoppingListIngredientAdmin(admin.ModelAdmin):
+    """Управление списками покупок в admin."""
+
+    list_display = ('id', 'user', 'ingredient', 'amount')
+    search_fields = ('user', 'ingredient')
+    list_filter = ('user',)
+    empty_value_display = '-пусто-'
+
+
+@admin.register(FeedItem)
+class FeedItemAdmin(admin.ModelAdmin):
+    """Управление лентами подписок в admin."""
+
+    list_display = ('id', 'user', 'recipe', 'author', 'pub_date')
+    list_filter = ('user',)
+    empty_value_display = '-пусто-'
@@ -0,0 +1,36 @@
+from time import time_ns
+
+from .db import insert_ignore
+from .models import DataVersion
+
+INGREDIENTS_VERSION = 'ingredients'
+RECIPES_VERSION = 'recipes'
+RECIPE_INDEX_VERSION = 'recipe_index'
+TAGS_VERSION = 'tags'
+
+
+def get_versions(*names):
+    """Текущие версии наборов данных `names` одним запросом (время
+    последнего изменения в наносекундах). Версии хранятся в БД,
+    поэтому после изменения данных их видят все процессы."""
+    versions = dict(DataVersion.objects.filter(
+        name__in=names).values_list('name', 'version'))
+    for name in names:
+        if name not in versions:
+            insert_ignore(DataVersion, name=name, version=time_ns())
+            versions[name] = DataVersion.objects.get(name=name).version
+    return tuple(versions[name] for name in names)
+
+
+def get_version(name):
+    """Текущая версия набора данных `name`."""
+    return get_versions(name)[0]
+
+
+def bump_version(name):
+    """Меняем версию набора данных `name` после его изменения.
+    Внутри транзакции новая версия станет видна вместе с данными."""
+    version = time_ns()
+    if not DataVersion.objects.filter(name=name).update(version=version):
+        if not insert_ignore(DataVersion, name=name, version=version):
+            DataVersion.objects.filter(name=name).update(version=version)
@@ -0,0 +1,35 @@
+from django.db import connection
+
+
+def insert_ignore_many(model, names, rows):
+    """Добавляем строки `rows` (значения полей `names`) одной командой
+    INSERT с пропуском конфликтов по уникальности. Возвращаем число
+    добавленных строк."""
+    if not rows:
+        return 0
+    ops = connection.ops
+    fields = [model._meta.get_field(name) for name in names]
+    placeholders = '({0})'.format(', '.join(['%s'] * len(fields)))
+    sql = '{0} {1} ({2}) VALUES {3} {4}'.format(
+        ops.insert_statement(ignore_conflicts=True),
+        ops.quote_name(model._meta.db_table),
+        ', '.join(ops.quote_name(field.column) for field in fields),
+        ', '.join([placeholders] * len(rows)),
+        ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+    )
+    params = [
+        field.get_db_prep_save(value, connection)
+        for row in rows
+        for field, value in zip(fields, row)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def insert_ignore(model, **values):
+    """Добавляем строку одной командой INSERT с пропуском конфликта
+    по уникальности (без предварительного чтения). Возвращаем True,
+    если строка добавлена, и False, если такая строка уже есть."""
+    return insert_ignore_many(
+        model, list(values), [list(values.values())]) == 1
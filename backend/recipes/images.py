@@ -0,0 +1,97 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+
+from .cache import RECIPES_VERSION, bump_version
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipes/variants/'
+VARIANT_FORMAT = 'WEBP'
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_PROCESSING_WORKERS,
+    thread_name_prefix='recipe-images'
+)
+
+
+def variant_name(image_name, variant):
+    """Имя файла уменьшенной копии фото."""
+    base = os.path.splitext(os.path.basename(image_name))[0]
+    return f'{VARIANTS_DIR}{base}_{variant}.webp'
+
+
+def render_variants(image_name):
+    """Сохраняем уменьшенные копии фото в формате WebP,
+    возвращаем словарь {вариант: имя файла}."""
+    variants = {}
+    with default_storage.open(image_name, 'rb') as file:
+        with Image.open(file) as image:
+            image.load()
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+                copy = image.copy()
+                copy.thumbnail(size)
+                buffer = BytesIO()
+                copy.save(
+                    buffer, VARIANT_FORMAT,
+                    quality=settings.RECIPE_IMAGE_QUALITY)
+                name = variant_name(image_name, variant)
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                variants[variant] = default_storage.save(
+                    name, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def delete_variants(variants):
+    """Удаляем файлы устаревших копий фото."""
+    for name in variants.values():
+        default_storage.delete(name)
+
+
+def build_variants(recipe_id, stale=None):
+    """Строим копии текущего фото рецепта и удаляем устаревшие.
+    Если фото успели заменить, результат не сохраняем."""
+    if stale:
+        delete_variants(stale)
+    image_name = Recipe.objects.filter(pk=recipe_id).values_list(
+        'image', flat=True).first()
+    if not image_name:
+        return False
+    variants = render_variants(image_name)
+    updated = Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+        image_variants=variants, modified_at=timezone.now())
+    if not updated:
+        delete_variants(variants)
+        return False
+    bump_version(RECIPES_VERSION)
+    return True
+
+
+def build_variants_in_background(recipe_id, stale=None):
+    """Задача фонового пула: ошибки только логируем,
+    соединение с БД потока закрываем."""
+    try:
+        build_variants(recipe_id, stale)
+    except Exception:
+        logger.exception('Не удалось обработать фото рецепта %s', recipe_id)
+    finally:
+        connection.close()
+
+
+def schedule_variants(recipe_id, stale=None):
+    """Ставим построение копий фото в очередь фонового пула
+    после фиксации транзакции."""
+    transaction.on_commit(lambda: executor.submit(
+        build_variants_in_background, recipe_id, stale))
@@ -0,0 +1,62 @@
+import threading
+from bisect import bisect_left
+from itertools import islice
+
+from django.conf import settings
+
+from .cache import INGREDIENTS_VERSION, get_version
+from .models import Ingredient
+
+
+class IngredientIndex:
+    """Отсортированный по названию индекс ингредиентов в памяти процесса.
+    Строится один раз и перестраивается при смене версии ингредиентов."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = ([], [])
+
+    def _refresh(self):
+        version = get_version(INGREDIENTS_VERSION)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            items = sorted(
+                Ingredient.objects.values('id', 'name', 'measurement_unit'),
+                key=lambda item: (item['name'].lower(), item['id'])
+            )
+            self._index = ([item['name'].lower() for item in items], items)
+            self._version = version
+
+    def all(self):
+        """Все ингредиенты в порядке названий."""
+        self._refresh()
+        return list(self._index[1])
+
+    def search(self, query, limit=None):
+        """Ищем ингредиенты: сначала совпадения по началу названия,
+        затем по вхождению в название (не больше `limit`)."""
+        self._refresh()
+        names, items = self._index
+        query = query.lower()
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        result = []
+        for position in range(bisect_left(names, query), len(names)):
+            if len(result) >= limit or not names[position].startswith(query):
+                break
+            result.append(items[position])
+        if len(result) < limit:
+            result.extend(islice(
+                (
+                    item for name, item in zip(names, items)
+                    if query in name and not name.startswith(query)
+                ),
+                limit - len(result)
+            ))
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,106 @@
+import random
+from itertools import accumulate
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+from recipes.recipe_index import RecipeIndex, RecipeRows
+
+PANTRY_SIZES = (5, 15, 30)
+
+
+class SyntheticRecipeIndex(RecipeIndex):
+    """Индекс на синтетических данных, без обращений к базе."""
+
+    def __init__(self, rows):
+        super().__init__()
+        self._rows = rows
+
+    def _refresh(self):
+        pass
+
+
+class Command(BaseCommand):
+    """Замер поиска похожих рецептов и рецептов по продуктам
+    на синтетическом индексе."""
+
+    help = ('Замер скорости индекса рецептов на синтетических данных '
+            '(база данных не используется).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=100000,
+            help='Количество рецептов в индексе.'
+        )
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=2000,
+            help='Количество разных ингредиентов.'
+        )
+        parser.add_argument(
+            '--tags',
+            type=int,
+            default=10,
+            help='Количество разных тегов.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Количество повторов каждого замера.'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Начальное значение генератора случайных чисел.'
+        )
+
+    def build_rows(self, generator, recipes, ingredients, tags):
+        """Доп.функция: рецепты из 4-12 ингредиентов с частотами по
+        закону Ципфа и одним тегом."""
+        population = range(1, ingredients + 1)
+        weights = list(accumulate(1 / rank for rank in population))
+        rows = RecipeRows()
+        for pk in range(1, recipes + 1):
+            features = set(generator.choices(
+                population, cum_weights=weights, k=generator.randint(4, 12)))
+            features.add(-generator.randint(1, tags))
+            rows.add(pk, list(features))
+        rows.sorted_rows = len(rows.pks)
+        return rows
+
+    def measure(self, repeat, function, *args):
+        """Доп.функция: среднее время вызова в мс и последний
+        результат."""
+        started = monotonic()
+        for _ in range(repeat):
+            result = function(*args)
+        return (monotonic() - started) / repeat * 1000, result
+
+    def handle(self, *args, **options):
+        generator = random.Random(options['seed'])
+        repeat = options['repeat']
+        started = monotonic()
+        rows = self.build_rows(
+            generator, options['recipes'], options['ingredients'],
+            options['tags'])
+        print(f'Индекс построен за {monotonic() - started:.1f} с, '
+              f'рецептов: {len(rows.pks)}.')
+        index = SyntheticRecipeIndex(rows)
+        common = range(1, min(200, options['ingredients']) + 1)
+        for size in PANTRY_SIZES:
+            pantry = generator.sample(common, min(size, len(common)))
+            elapsed, result = self.measure(
+                repeat, index.pantry, pantry, 2, [1, 2], 20)
+            print(f'По продуктам ({len(pantry)} ингредиентов): '
+                  f'{elapsed:.1f} мс, найдено: {len(result)}.')
+        recipe_ids = generator.sample(
+            range(1, len(rows.pks) + 1), min(repeat, len(rows.pks)))
+        started = monotonic()
+        for recipe_id in recipe_ids:
+            index.similar(recipe_id, 6)
+        elapsed = (monotonic() - started) / max(len(recipe_ids), 1) * 1000
+        print(f'Похожие рецепты: {elapsed:.1f} мс.')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from recipes.images import build_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Построение уменьшенных копий фото рецептов."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Перестроить копии у всех рецептов, а не только у новых.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        built = 0
+        for recipe_id in recipes.values_list('pk', flat=True).iterator():
+            built += build_variants(recipe_id)
+        print(f'Копии фото построены, рецептов: {built}.')
@@ -1,21 +1,84 @@
 import csv
+import json
+import os
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.cache import INGREDIENTS_VERSION, bump_version
+from recipes.db import insert_ignore_many
 from recipes.models import Ingredient
 
+DATA_DIR = './data'
+
 
 class Command(BaseCommand):
-    """Импорт данных из csv в модель Ingredient."""
+    """Импорт данных из csv или json в модель Ingredient."""
+
+    help = 'Загрузка ингредиентов из файла в формате csv или json.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default='ingredients.csv',
+            help='Путь к файлу или имя файла в каталоге ./data/.'
+        )
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            help='Формат файла (по умолчанию - по расширению файла).'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество ингредиентов в одном INSERT.'
+        )
+
+    def read_csv(self, file):
+        for row in csv.reader(file):
+            yield row[0], row[1]
+
+    def read_json(self, file):
+        for item in json.load(file):
+            yield item['name'], item['measurement_unit']
 
-    def import_ingredients(self, file='ingredients.csv'):
-        with open(f'./data/{file}', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                status, created = Ingredient.objects.update_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
-                )
+    def import_ingredients(self, path, reader, batch_size):
+        """Добавляем новые ингредиенты пачками по `batch_size`,
+        уже загруженные и повторяющиеся строки пропускаем (в том числе
+        добавленные параллельной загрузкой - по уникальности названия
+        и единицы измерения). Возвращаем число добавленных строк."""
+        existing = set(
+            Ingredient.objects.values_list('name', 'measurement_unit'))
+        fields = ('name', 'measurement_unit')
+        created = 0
+        batch = []
+        with open(path, newline='', encoding='utf-8') as f, \
+                transaction.atomic():
+            for ingredient in reader(f):
+                if ingredient in existing:
+                    continue
+                existing.add(ingredient)
+                batch.append(ingredient)
+                if len(batch) >= batch_size:
+                    created += insert_ignore_many(Ingredient, fields, batch)
+                    batch = []
+            created += insert_ignore_many(Ingredient, fields, batch)
+        return created
 
     def handle(self, *args, **options):
-        self.import_ingredients()
-        print('Загрузка завершена.')
+        path = options['file']
+        if not os.path.exists(path):
+            path = os.path.join(DATA_DIR, path)
+        file_format = (
+            options['format'] or os.path.splitext(path)[1].lstrip('.'))
+        readers = {'csv': self.read_csv, 'json': self.read_json}
+        if file_format not in readers:
+            raise CommandError(
+                'Не удалось определить формат файла, укажите --format.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        created = self.import_ingredients(
+            path, readers[file_format], options['batch_size'])
+        if created:
+            bump_version(INGREDIENTS_VERSION)
+        print(f'Загрузка завершена. Добавлено ингредиентов: {created}.')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from recipes.cache import RECIPE_INDEX_VERSION, bump_version
+
+
+class Command(BaseCommand):
+    """Перестроение индекса похожих рецептов."""
+
+    help = 'Полное перестроение индекса рецептов во всех процессах.'
+
+    def handle(self, *args, **options):
+        bump_version(RECIPE_INDEX_VERSION)
+        print('Версия индекса рецептов изменена: каждый процесс '
+              'приложения перестроит индекс при следующем поиске похожих '
+              'рецептов или рецептов по продуктам.')
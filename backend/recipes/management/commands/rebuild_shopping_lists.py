@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from recipes.models import ShoppingListIngredient
+
+
+class Command(BaseCommand):
+    """Пересборка списков покупок всех пользователей по их корзинам."""
+
+    def handle(self, *args, **options):
+        count = ShoppingListIngredient.rebuild()
+        print(f'Списки покупок пересобраны, строк: {count}.')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Пересчет счетчиков избранного и корзин у всех рецептов."""
+
+    def handle(self, *args, **options):
+        count = Recipe.reconcile_counters()
+        print(f'Счетчики пересчитаны, рецептов: {count}.')
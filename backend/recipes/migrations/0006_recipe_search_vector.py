@@ -0,0 +1,56 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:44
+
+from django.conf import settings
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+SEARCH_VECTOR_INDEX = 'recipe_search_vector_gin_idx'
+
+
+def create_search_vector_index(apps, schema_editor):
+    # Вектор, GIN-индекс и ранжирование используются только в PostgreSQL.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {SEARCH_VECTOR_INDEX} '
+        'ON recipes_recipe USING gin (search_vector)'
+    )
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredients = apps.get_model('recipes', 'RecipeIngredients')
+    config = settings.SEARCH_CONFIG
+    ingredient_names = RecipeIngredients.objects.filter(
+        recipe=OuterRef('pk')).values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')).values('names')
+    Recipe.objects.update(search_vector=(
+        django.contrib.postgres.search.SearchVector(
+            'name', weight='A', config=config)
+        + django.contrib.postgres.search.SearchVector(
+            Subquery(ingredient_names), weight='B', config=config)
+        + django.contrib.postgres.search.SearchVector(
+            'text', weight='C', config=config)
+    ))
+
+
+def drop_search_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {SEARCH_VECTOR_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(
+            create_search_vector_index, drop_search_vector_index),
+    ]
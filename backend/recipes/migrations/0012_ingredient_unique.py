@@ -0,0 +1,57 @@
+# Generated by Django 3.2.3 on 2026-10-18 03:27
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_rows(model, field, duplicate_id, ingredient_id):
+    """Переносим строки дубликата ингредиента на оставляемый
+    ингредиент, количества совпадающих строк складываем."""
+    for row in model.objects.filter(ingredient_id=duplicate_id):
+        target = model.objects.filter(
+            ingredient_id=ingredient_id,
+            **{field: getattr(row, field)}).first()
+        if target is None:
+            row.ingredient_id = ingredient_id
+            row.save(update_fields=['ingredient'])
+        else:
+            target.amount += row.amount
+            target.save(update_fields=['amount'])
+            row.delete()
+
+
+def merge_duplicates(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredients = apps.get_model('recipes', 'RecipeIngredients')
+    ShoppingListIngredient = apps.get_model(
+        'recipes', 'ShoppingListIngredient')
+    groups = Ingredient.objects.values('name', 'measurement_unit').annotate(
+        count=Count('id'), keep_id=Min('id')).filter(count__gt=1)
+    for group in groups:
+        duplicates = Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep_id'])
+        for duplicate_id in duplicates.values_list('id', flat=True):
+            merge_rows(
+                RecipeIngredients, 'recipe_id', duplicate_id,
+                group['keep_id'])
+            merge_rows(
+                ShoppingListIngredient, 'user_id', duplicate_id,
+                group['keep_id'])
+        duplicates.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_dataversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='уникальность_сочетания_название_единица_измерения'),
+        ),
+    ]
@@ -1,7 +1,12 @@
 from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
-from users.models import User
+from django.db import connection, models, transaction
+from django.db.models import (Case, Count, F, IntegerField, OuterRef, Subquery,
+                              Sum, Value, When)
+from django.db.models.functions import Coalesce, Greatest
+from users.models import Subscription, User
 
 
 class Tag(models.Model):
@@ -48,6 +53,12 @@ class Ingredient(models.Model):
         ordering = ['name']
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='уникальность_сочетания_название_единица_измерения'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -75,6 +86,11 @@ class Recipe(models.Model):
         verbose_name='Фото',
         upload_to='recipes/'
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии фото',
+        default=dict,
+        editable=False
+    )
     name = models.CharField(
         verbose_name='Название рецепта',
         max_length=settings.MAX_LENGTH_RECIPES
@@ -89,11 +105,44 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    modified_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В корзинах',
+        default=0,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False
+    )
 
     class Meta:
         ordering = ['-pub_date', 'name']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', 'name'],
+                name='recipe_pub_date_name_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-pub_date'],
+                name='recipe_popular_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'name'],
@@ -109,6 +158,51 @@ class Recipe(models.Model):
         """Проверяем, находится ли рецепт в корзине"""
         return self.shopping_cart.filter(user=user).exists()
 
+    @classmethod
+    def change_counter(cls, pk, field, delta):
+        """Атомарно меняем счетчик рецепта (`favorites_count`,
+        `in_carts_count`) на `delta`."""
+        cls.change_counters([pk], field, delta)
+
+    @classmethod
+    def change_counters(cls, pks, field, delta):
+        """Атомарно меняем счетчик у нескольких рецептов сразу."""
+        if pks:
+            cls.objects.filter(pk__in=pks).update(
+                **{field: Greatest(F(field) + delta, Value(0))})
+
+    @classmethod
+    def reconcile_counters(cls):
+        """Пересчитываем счетчики избранного и корзин всех рецептов."""
+        return cls.objects.update(
+            favorites_count=Coalesce(Subquery(
+                Favorite.objects.filter(recipe=OuterRef('pk')).values(
+                    'recipe').annotate(total=Count('pk')).values('total')
+            ), 0),
+            in_carts_count=Coalesce(Subquery(
+                ShoppingCart.objects.filter(recipe=OuterRef('pk')).values(
+                    'recipe').annotate(total=Count('pk')).values('total')
+            ), 0),
+        )
+
+    @classmethod
+    def update_search_vector(cls, *args, **kwargs):
+        """Пересчитываем поисковый вектор (название, ингредиенты,
+        описание) у отобранных рецептов. Вектор хранится только
+        в PostgreSQL."""
+        if connection.vendor != 'postgresql':
+            return
+        config = settings.SEARCH_CONFIG
+        ingredient_names = RecipeIngredients.objects.filter(
+            recipe=OuterRef('pk')).values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' ')).values('names')
+        cls.objects.filter(*args, **kwargs).update(search_vector=(
+            SearchVector('name', weight='A', config=config)
+            + SearchVector(Subquery(ingredient_names), weight='B',
+                           config=config)
+            + SearchVector('text', weight='C', config=config)
+        ))
+
     def __str__(self):
         return self.name
 
@@ -203,3 +297,233 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил {self.recipe} в корзину покупок.'
+
+
+class ShoppingListIngredient(models.Model):
+    """Модель итогового количества ингредиента в списке покупок
+    пользователя (денормализованная сумма по рецептам из корзины)."""
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='уникальность_сочетания_списка_пользователь_ингредиент'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} – {self.amount}'
+
+    @classmethod
+    def apply_amounts(cls, user_ids, amounts):
+        """Прибавляем к спискам покупок пользователей изменения
+        количества ингредиентов вида {ingredient_id: delta}."""
+        amounts = {
+            ingredient_id: delta
+            for ingredient_id, delta in amounts.items() if delta
+        }
+        user_ids = list(user_ids)
+        if not user_ids or not amounts:
+            return
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                [
+                    cls(user_id=user_id, ingredient_id=ingredient_id,
+                        amount=0)
+                    for user_id in user_ids
+                    for ingredient_id, delta in amounts.items() if delta > 0
+                ],
+                ignore_conflicts=True
+            )
+            items = cls.objects.filter(
+                user_id__in=user_ids, ingredient_id__in=amounts)
+            items.update(amount=Greatest(
+                F('amount') + Case(
+                    *[When(ingredient_id=ingredient_id, then=Value(delta))
+                      for ingredient_id, delta in amounts.items()],
+                    default=Value(0),
+                    output_field=IntegerField()
+                ),
+                Value(0)
+            ))
+            items.filter(amount=0).delete()
+
+    @classmethod
+    def add_recipe(cls, user, recipe):
+        """Добавляем ингредиенты рецепта в список покупок."""
+        cls.apply_amounts([user.id], dict(
+            recipe.recipeingredients.values_list('ingredient_id', 'amount')))
+
+    @classmethod
+    def apply_recipes(cls, user, added=(), removed=()):
+        """Добавляем в список покупок ингредиенты рецептов `added`
+        и убираем ингредиенты рецептов `removed` (id рецептов)."""
+        added = set(added)
+        amounts = {}
+        for recipe_id, ingredient_id, amount in (
+                RecipeIngredients.objects.filter(
+                    recipe__in=[*added, *removed]).values_list(
+                        'recipe_id', 'ingredient_id', 'amount')):
+            amounts[ingredient_id] = amounts.get(ingredient_id, 0) + (
+                amount if recipe_id in added else -amount)
+        cls.apply_amounts([user.id], amounts)
+
+    @classmethod
+    def update_recipe(cls, recipe, old_amounts, new_amounts):
+        """Переносим изменение состава рецепта в списки покупок всех
+        пользователей, у которых он лежит в корзине."""
+        cls.apply_amounts(
+            recipe.shopping_cart.values_list('user_id', flat=True),
+            {
+                ingredient_id: (new_amounts.get(ingredient_id, 0)
+                                - old_amounts.get(ingredient_id, 0))
+                for ingredient_id in {*old_amounts, *new_amounts}
+            }
+        )
+
+    @classmethod
+    def rebuild(cls):
+        """Пересобираем списки покупок всех пользователей по корзинам."""
+        totals = RecipeIngredients.objects.filter(
+            recipe__shopping_cart__isnull=False).values(
+                'recipe__shopping_cart__user', 'ingredient').annotate(
+                    total_amount=Sum('amount')).order_by()
+        with transaction.atomic():
+            cls.objects.all().delete()
+            return len(cls.objects.bulk_create(
+                (
+                    cls(user_id=item['recipe__shopping_cart__user'],
+                        ingredient_id=item['ingredient'],
+                        amount=item['total_amount'])
+                    for item in totals.iterator()
+                ),
+                batch_size=1000
+            ))
+
+
+class FeedItem(models.Model):
+    """Модель ленты подписок: рецепт автора, разложенный в ленту
+    подписчика при публикации (fan-out-on-write). Рецепты авторов
+    с `feed_on_read` в ленту не раскладываются и читаются напрямую."""
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Подписчик',
+        on_delete=models.CASCADE,
+        related_name='feed'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='feed_items'
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор',
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Ленты подписок'
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_user_pub_date_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='уникальность_сочетания_лента_рецепт'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+    @classmethod
+    def publish(cls, recipe):
+        """Раскладываем новый рецепт в ленты подписчиков автора.
+        Если подписчиков больше `FEED_FANOUT_LIMIT`, переводим автора
+        на сборку ленты при чтении."""
+        author = recipe.author
+        if author.feed_on_read:
+            return
+        limit = settings.FEED_FANOUT_LIMIT
+        followers = list(Subscription.objects.filter(
+            author=author).values_list('user_id', flat=True)[:limit + 1])
+        if len(followers) > limit:
+            User.objects.filter(pk=author.pk).update(feed_on_read=True)
+            author.feed_on_read = True
+            return
+        cls.objects.bulk_create(
+            [
+                cls(user_id=user_id, recipe=recipe, author=author,
+                    pub_date=recipe.pub_date)
+                for user_id in followers
+            ],
+            ignore_conflicts=True,
+            batch_size=1000
+        )
+
+    @classmethod
+    def follow(cls, user, author_ids):
+        """Добавляем в ленту рецепты новых авторов подписки."""
+        recipes = Recipe.objects.filter(
+            author__in=author_ids, author__feed_on_read=False).values_list(
+                'id', 'author_id', 'pub_date')
+        cls.objects.bulk_create(
+            (
+                cls(user=user, recipe_id=recipe_id, author_id=author_id,
+                    pub_date=pub_date)
+                for recipe_id, author_id, pub_date in recipes.iterator()
+            ),
+            ignore_conflicts=True,
+            batch_size=1000
+        )
+
+    @classmethod
+    def unfollow(cls, user, author_ids):
+        """Убираем из ленты рецепты авторов, от которых отписались."""
+        cls.objects.filter(user=user, author__in=author_ids).delete()
+
+
+class DataVersion(models.Model):
+    """Версия набора данных (ингредиенты, теги, рецепты): время
+    последнего изменения в наносекундах. Хранится в БД, поэтому
+    одинакова для всех процессов приложения."""
+    name = models.CharField(
+        primary_key=True,
+        max_length=32,
+        verbose_name='Набор данных'
+    )
+    version = models.BigIntegerField(verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
@@ -0,0 +1,223 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import RECIPE_INDEX_VERSION, RECIPES_VERSION, get_versions
+from .models import Recipe, RecipeIngredients
+
+SYNC_MARGIN = timedelta(minutes=1)
+
+
+def iter_recipe_features(**filters):
+    """Признаки рецептов по возрастанию id: id ингредиентов и id тегов
+    со знаком минус. Ингредиенты и теги читаются двумя потоками,
+    упорядоченными по рецепту, и сливаются без загрузки в память."""
+    ingredients = RecipeIngredients.objects.filter(**filters).order_by(
+        'recipe_id').values_list('recipe_id', 'ingredient_id')
+    tags = Recipe.tags.through.objects.filter(**filters).order_by(
+        'recipe_id').values_list('recipe_id', 'tag_id')
+    merged = heapq.merge(
+        ingredients.iterator(),
+        ((recipe_id, -tag_id) for recipe_id, tag_id in tags.iterator()),
+        key=itemgetter(0)
+    )
+    for recipe_id, group in groupby(merged, key=itemgetter(0)):
+        yield recipe_id, [feature for _, feature in group]
+
+
+class RecipeRows:
+    """Признаки рецептов в компактном виде: строки рецептов хранятся
+    в массивах int (`pks`, `offsets`, `features`, `sizes` - число
+    ингредиентов), обратный индекс - признак -> массив номеров строк."""
+
+    def __init__(self):
+        self.pks = array('q')
+        self.offsets = array('q', [0])
+        self.features = array('i')
+        self.sizes = array('i')
+        self.postings = {}
+        self.sorted_rows = 0
+        self.moved = {}
+
+    def add(self, pk, features):
+        row = len(self.pks)
+        self.features.extend(sorted(features))
+        self.offsets.append(len(self.features))
+        self.sizes.append(sum(1 for feature in features if feature > 0))
+        for feature in features:
+            self.postings.setdefault(feature, array('i')).append(row)
+        self.pks.append(pk)
+        return row
+
+    def copy(self):
+        """Копия для изменения: читатели без блокировки продолжают
+        работать со старым экземпляром."""
+        rows = RecipeRows()
+        rows.pks = array('q', self.pks)
+        rows.offsets = array('q', self.offsets)
+        rows.features = array('i', self.features)
+        rows.sizes = array('i', self.sizes)
+        rows.postings = {
+            feature: array('i', posting)
+            for feature, posting in self.postings.items()
+        }
+        rows.sorted_rows = self.sorted_rows
+        rows.moved = dict(self.moved)
+        return rows
+
+    def row(self, pk):
+        """Номер актуальной строки рецепта или None. Строки первичного
+        построения упорядочены по id, добавленные позже - в `moved`."""
+        if pk in self.moved:
+            return self.moved[pk]
+        position = bisect_left(self.pks, pk, 0, self.sorted_rows)
+        if position < self.sorted_rows and self.pks[position] == pk:
+            return position
+        return None
+
+    def is_current(self, row):
+        return self.row(self.pks[row]) == row
+
+    def row_features(self, row):
+        return self.features[self.offsets[row]:self.offsets[row + 1]]
+
+
+class RecipeIndex:
+    """Индекс рецептов в памяти процесса для поиска похожих рецептов
+    и рецептов по имеющимся продуктам. Поиск идет без блокировки:
+    изменения собираются в новом экземпляре RecipeRows, который затем
+    подменяет текущий.
+    Изменившиеся рецепты дописываются новыми строками при смене версии
+    рецептов (старые строки пропускаются), после
+    `RECIPE_INDEX_REBUILD_THRESHOLD` изменений и по команде
+    rebuild_recipe_index индекс строится заново."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = RecipeRows()
+        self._index_version = None
+        self._recipes_version = None
+        self._synced_at = None
+
+    def _build(self):
+        synced_at = timezone.now()
+        rows = RecipeRows()
+        for pk, features in iter_recipe_features():
+            rows.add(pk, features)
+        rows.sorted_rows = len(rows.pks)
+        self._rows = rows
+        self._synced_at = synced_at
+
+    def _sync(self):
+        synced_at = timezone.now()
+        changed = list(Recipe.objects.filter(
+            modified_at__gte=self._synced_at - SYNC_MARGIN).values_list(
+                'pk', flat=True))
+        if len(self._rows.moved) + len(changed) > (
+                settings.RECIPE_INDEX_REBUILD_THRESHOLD):
+            return self._build()
+        rows = self._rows.copy()
+        for pk in changed:
+            rows.moved[pk] = None
+        for pk, features in iter_recipe_features(recipe_id__in=changed):
+            rows.moved[pk] = rows.add(pk, features)
+        self._rows = rows
+        self._synced_at = synced_at
+
+    def _refresh(self):
+        index_version, recipes_version = get_versions(
+            RECIPE_INDEX_VERSION, RECIPES_VERSION)
+        if (index_version, recipes_version) == (
+                self._index_version, self._recipes_version):
+            return
+        with self._lock:
+            if index_version != self._index_version:
+                self._build()
+            elif recipes_version != self._recipes_version:
+                self._sync()
+            self._index_version = index_version
+            self._recipes_version = recipes_version
+
+    def get_candidates(self, rows, features, exclude):
+        """Доп.функция: строки с наибольшим числом общих признаков.
+        Для отбора берем только редкие признаки (не чаще
+        `RECIPE_INDEX_MAX_POSTING`), частые учитываются при
+        точном подсчете сходства."""
+        postings = sorted(
+            (rows.postings.get(feature, ()) for feature in features),
+            key=len
+        )
+        selective = [
+            posting for posting in postings
+            if len(posting) <= settings.RECIPE_INDEX_MAX_POSTING
+        ] or postings[:1]
+        hits = Counter()
+        for posting in selective:
+            hits.update(posting)
+        hits.pop(exclude, None)
+        limit = settings.SIMILAR_RECIPES_CANDIDATES
+        best = heapq.nlargest(
+            limit + len(rows.moved), hits, key=hits.__getitem__)
+        return [row for row in best if rows.is_current(row)][:limit]
+
+    def similar(self, recipe_id, limit):
+        """Рецепты с наибольшим сходством Жаккара по ингредиентам
+        и тегам: список пар (id рецепта, сходство)."""
+        self._refresh()
+        rows = self._rows
+        row = rows.row(recipe_id)
+        if row is None:
+            return []
+        features = set(rows.row_features(row))
+        scores = []
+        for candidate in self.get_candidates(rows, features, row):
+            other = rows.row_features(candidate)
+            common = len(features.intersection(other))
+            scores.append((
+                common / (len(features) + len(other) - common),
+                -rows.pks[candidate]
+            ))
+        return [
+            (-negative_pk, score)
+            for score, negative_pk in heapq.nlargest(limit, scores)
+        ]
+
+    def pantry(self, ingredient_ids, max_missing=0, tag_ids=None, limit=20):
+        """Рецепты, для которых не хватает не больше `max_missing`
+        ингредиентов из `ingredient_ids`, с тегом из `tag_ids` (если
+        задан): список троек (id рецепта, доля имеющихся ингредиентов,
+        число недостающих), лучшие по доле ингредиентов - первыми."""
+        self._refresh()
+        rows = self._rows
+        hits = Counter()
+        for ingredient_id in set(ingredient_ids):
+            hits.update(rows.postings.get(ingredient_id, ()))
+        if tag_ids is not None:
+            tagged = set()
+            for tag_id in tag_ids:
+                tagged.update(rows.postings.get(-tag_id, ()))
+        results = []
+        for row, count in hits.items():
+            missing = rows.sizes[row] - count
+            if missing > max_missing:
+                continue
+            if tag_ids is not None and row not in tagged:
+                continue
+            if rows.is_current(row):
+                results.append((count / rows.sizes[row], -missing, row))
+        return [
+            (rows.pks[row], coverage, -negative_missing)
+            for coverage, negative_missing, row in heapq.nlargest(
+                limit, results)
+        ]
+
+
+recipe_index = RecipeIndex()
@@ -0,0 +1,49 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import (INGREDIENTS_VERSION, RECIPES_VERSION, TAGS_VERSION,
+                    bump_version)
+from .models import Ingredient, Recipe, ShoppingListIngredient, Tag
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    """Перед удалением рецепта вычитаем его ингредиенты из списков
+    покупок (строки корзины удалятся каскадно)."""
+    ShoppingListIngredient.update_recipe(
+        instance,
+        dict(instance.recipeingredients.values_list(
+            'ingredient_id', 'amount')),
+        {}
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """Меняем версию ингредиентов: индекс поиска перестроится
+    во всех процессах."""
+    bump_version(INGREDIENTS_VERSION)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search_vector(sender, instance, created,
+                                            **kwargs):
+    """После переименования ингредиента обновляем поисковые векторы
+    рецептов, в которые он входит."""
+    if not created:
+        Recipe.update_search_vector(ingredients=instance)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    """Меняем версию тегов (для ETag, кэшей и словаря `tag_index`)."""
+    bump_version(TAGS_VERSION)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipes_version(sender, **kwargs):
+    """Меняем версию каталога рецептов (для кэша списка рецептов)."""
+    bump_version(RECIPES_VERSION)
@@ -0,0 +1,38 @@
+import threading
+
+from .cache import TAGS_VERSION, get_version
+from .models import Tag
+
+
+class TagIndex:
+    """Словарь слаг -> id тегов в памяти процесса.
+    Перестраивается при смене версии тегов."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._ids = {}
+
+    def _refresh(self):
+        version = get_version(TAGS_VERSION)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            self._ids = dict(Tag.objects.values_list('slug', 'id'))
+            self._version = version
+
+    def choices(self):
+        """Слаги тегов для валидации параметра `tags`."""
+        self._refresh()
+        return [(slug, slug) for slug in self._ids]
+
+    def ids(self, slugs):
+        """id тегов по слагам (неизвестные слаги пропускаем)."""
+        self._refresh()
+        ids = self._ids
+        return [ids[slug] for slug in slugs if slug in ids]
+
+
+tag_index = TagIndex()
@@ -0,0 +1,25 @@
+import base64
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywaAAAACVBMVEUAAAD///9fX1/S0e'
+    'cCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQImWNoAAAAggCByxOyYQAAAABJRU5E'
+    'rkJggg=='
+)
+
+
+class MediaTestCase(TestCase):
+    """Тесты с загрузкой фото: MEDIA_ROOT - временный каталог,
+    который удаляется после тестов класса."""
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+        super().setUpClass()
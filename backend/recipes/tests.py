@@ -0,0 +1,40 @@
+from unittest import skipUnless
+
+from django.core.files.base import ContentFile
+from django.db import connection
+from users.models import User
+
+from .models import Recipe
+from .testing import PNG, MediaTestCase
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Планы запросов PostgreSQL.')
+class RecipeIndexesTest(MediaTestCase):
+    """Лента рецептов читается по индексам, а не полным перебором
+    с сортировкой."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw')
+        for i in range(20):
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {i}', text='Описание',
+                cooking_time=5, image=ContentFile(PNG, name='image.png'))
+
+    def get_plan(self, queryset):
+        """Доп.функция: план запроса без последовательного чтения
+        (на маленькой таблице планировщик выбрал бы его)."""
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_feed_uses_pub_date_index(self):
+        plan = self.get_plan(Recipe.objects.all()[:6])
+        self.assertIn('recipe_pub_date_name_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_author_feed_uses_author_index(self):
+        recipes = Recipe.objects.filter(author=self.author)
+        plan = self.get_plan(recipes.order_by('-pub_date')[:6])
+        self.assertIn('recipe_author_pub_date_idx', plan)
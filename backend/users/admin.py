@@ -5,7 +5,10 @@ from users.models import Subscription, User
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     """Управление пользователями в admin."""
-    fields = ('username', 'email', 'first_name', 'last_name', 'password')
+    fields = (
+        'username', 'email', 'first_name', 'last_name', 'password',
+        'feed_on_read',
+    )
     list_display = ('id', 'username', 'email', 'first_name', 'last_name')
     search_fields = ('username', 'email',)
     list_filter = ('username', 'email',)
@@ -0,0 +1,81 @@
+import logging
+from hashlib import sha256
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+logger = logging.getLogger(__name__)
+
+TOKEN_KEY = 'auth_token:{0}'
+UNCACHED_USER_FIELDS = ('password',)
+
+
+def get_token_cache_key(key):
+    """Ключ кэша токена: сам токен в ключ не попадает."""
+    return TOKEN_KEY.format(sha256(key.encode()).hexdigest())
+
+
+def dump_user(user):
+    """Доп.функция: поля пользователя для кэша без хэша пароля."""
+    return {
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields
+        if field.attname not in UNCACHED_USER_FIELDS
+    }
+
+
+def load_user(values):
+    """Доп.функция: пользователь из кэша. Не сохраненные в кэше поля
+    отложены (как после defer) и читаются из БД при обращении."""
+    model = get_user_model()
+    return model.from_db(
+        router.db_for_read(model), list(values), list(values.values()))
+
+
+def forget_token(key):
+    """Удаляем пользователя токена `key` из кэша."""
+    try:
+        cache.delete(get_token_cache_key(key))
+    except Exception:
+        logger.warning('Не удалось удалить токен из кэша', exc_info=True)
+
+
+def forget_user_tokens(user):
+    """Удаляем из кэша все токены пользователя."""
+    for key in Token.objects.filter(user=user).values_list('key', flat=True):
+        forget_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену с кэшированием пользователя токена
+    на `AUTH_TOKEN_CACHE_TIMEOUT` секунд. В кэше хранятся поля
+    пользователя без пароля под хэшем токена. Если кэш недоступен,
+    пользователь читается из БД, как в TokenAuthentication.
+    Выход и изменение пользователя удаляют запись из кэша, но с кэшем
+    в памяти процесса (LocMemCache) - только в текущем процессе:
+    остальные принимают старый токен еще до `AUTH_TOKEN_CACHE_TIMEOUT`
+    секунд. При нескольких процессах нужен общий кэш (`CACHE_BACKEND`:
+    Redis, Memcached)."""
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+        try:
+            values = cache.get(cache_key)
+        except Exception:
+            logger.warning('Кэш токенов недоступен', exc_info=True)
+            return super().authenticate_credentials(key)
+        if values is not None:
+            user = load_user(values)
+            return user, self.get_model()(key=key, user=user)
+        user, token = super().authenticate_credentials(key)
+        try:
+            cache.set(
+                cache_key, dump_user(user),
+                settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        except Exception:
+            logger.warning('Кэш токенов недоступен', exc_info=True)
+        return user, token
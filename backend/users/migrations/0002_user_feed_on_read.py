@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_on_read',
+            field=models.BooleanField(default=False, help_text='Включается автоматически, когда подписчиков больше FEED_FANOUT_LIMIT.', verbose_name='Лента подписчиков собирается при чтении'),
+        ),
+    ]
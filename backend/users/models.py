@@ -30,6 +30,16 @@ class User(AbstractUser):
         verbose_name='Пароль',
         max_length=settings.MAX_LENGTH_USER
     )
+    feed_on_read = models.BooleanField(
+        verbose_name='Лента подписчиков собирается при чтении',
+        default=False,
+        help_text='Включается автоматически, когда подписчиков больше '
+                  'FEED_FANOUT_LIMIT.'
+    )
+    modified_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
 
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['email', 'first_name', 'last_name']
@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipes.cache import RECIPES_VERSION, bump_version
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_token, forget_user_tokens
+
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    """Выход (djoser token/logout) удаляет токен - убираем его из кэша."""
+    forget_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def forget_changed_user_tokens(sender, instance, created, **kwargs):
+    """После изменения пользователя (смена пароля, деактивация)
+    убираем его токены из кэша после фиксации транзакции."""
+    if not created:
+        transaction.on_commit(lambda: forget_user_tokens(instance))
+
+
+@receiver(post_save, sender=get_user_model())
+def bump_author_recipes_version(sender, instance, created, update_fields,
+                                **kwargs):
+    """Профиль автора входит в кэш списка рецептов: после изменения
+    полей автора меняем версию каталога (вход с обновлением только
+    last_login ее не меняет)."""
+    if created or (update_fields is not None
+                   and not AUTHOR_FIELDS.intersection(update_fields)):
+        return
+    if instance.recipes.exists():
+        bump_version(RECIPES_VERSION)